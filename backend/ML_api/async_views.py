@@ -0,0 +1,197 @@
+# ML_api/async_views.py
+"""
+Async-native versions of the ML_api endpoints, for deployment through
+core/asgi.py (e.g. `uvicorn core.asgi:application`).
+
+Redis calls go through redis.asyncio, and detect_pii runs on a bounded
+thread pool (settings.AEGIS_INFERENCE_THREADS). One process can therefore
+hold many open connections while inference capacity is sized separately.
+Enable with AEGIS_ASYNC_VIEWS=1 (see ML_api/urls.py).
+"""
+
+import asyncio
+import json
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.http import JsonResponse
+
+from ml_service.ingest import UploadRejected, decode_base64, read_upload
+from ml_service.pii_detection import detect_pii
+from ml_service.redis_client import (
+    GLOBAL_STATS_KEY, JOB_INPUT_KEY, JOB_INPUT_TTL, JOB_QUEUE_KEY, LABEL_STATS_KEY,
+    NOTIFY_KEY, PROCESSED_KEY, get_async_redis, queue_result, queue_scores, requeue_notify_token
+)
+from .views import WINDOWS, build_stats_response, build_window_response, window_bucket_keys
+
+
+# ------------------------------------
+# 🔹 INFERENCE EXECUTOR
+# ------------------------------------
+_executor = ThreadPoolExecutor(
+    max_workers=getattr(settings, "AEGIS_INFERENCE_THREADS", 4),
+    thread_name_prefix="aegis-inference"
+)
+
+
+async def run_inference(func, *args):
+    return await asyncio.get_running_loop().run_in_executor(_executor, func, *args)
+
+
+def _request_data(request):
+    if request.content_type == "application/json":
+        try:
+            return json.loads(request.body or b"{}")
+        except json.JSONDecodeError:
+            return {}
+    return request.POST
+
+
+def _exempt(view):
+    # csrf_exempt() wraps views in a sync function on Django 4.2, which
+    # would hide the coroutine; setting the flag directly keeps it async.
+    view.csrf_exempt = True
+    return view
+
+
+# ------------------------------------
+# 🔹 1. TEXT / IMAGE ANALYZE ENDPOINT
+# ------------------------------------
+@_exempt
+async def analyze_endpoint(request):
+    """ POST /api/analyze/ → same contract as views.analyze_endpoint """
+    if request.method != "POST":
+        return JsonResponse({"error": "Only POST allowed"}, status=405)
+
+    data = _request_data(request)
+    text = (data.get("text") or "").strip()
+    image = request.FILES.get("image", None)
+    image_base64 = data.get("image_base64", None)
+    async_mode = str(data.get("async", request.GET.get("async", ""))).lower() in ("1", "true")
+    async_mode = async_mode or getattr(settings, "AEGIS_ASYNC_ANALYZE", False)
+
+    try:
+        if text:
+            kind, payload = "text", text
+        elif image:
+            kind, payload = "file", await run_inference(read_upload, image)
+        elif image_base64:
+            kind, payload = "file", await run_inference(decode_base64, image_base64)
+        else:
+            return JsonResponse({"error": "No text or image provided."}, status=400)
+    except UploadRejected as e:
+        return JsonResponse({"error": str(e)}, status=e.status)
+
+    rd = get_async_redis()
+    try:
+        session_id = str(uuid.uuid4())
+
+        # ⏩ Async mode: hand the raw input to the inference workers
+        if async_mode:
+            job = {"session_id": session_id, "kind": kind, "submitted_at": time.time()}
+            pipe = rd.pipeline(transaction=False)
+            pipe.set(JOB_INPUT_KEY.format(session_id=session_id), payload, ex=JOB_INPUT_TTL)
+            pipe.lpush(JOB_QUEUE_KEY, json.dumps(job))
+            await pipe.execute()
+            return JsonResponse({"status": "queued", "session_id": session_id}, status=202)
+
+        result = await run_inference(detect_pii, payload)
+
+        # 🧾 Queue to Consumer + 🚀 Pathway stream, in one round trip
+        pipe = rd.pipeline(transaction=False)
+        queue_result(pipe, session_id, result)
+        pathway_push_count = queue_scores(pipe, result, session_id)
+        await pipe.execute()
+
+        return JsonResponse({
+            "status": "queued",
+            "session_id": session_id,
+            "pathway_pushed": pathway_push_count,
+            "detections": result
+        }, status=200)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+# ------------------------------------
+# 🔹 2. GET RESULT ENDPOINT (Consumer)
+# ------------------------------------
+async def get_results(request):
+    """ GET /api/get_results/?session_id=...&wait=<seconds> """
+    session_id = request.GET.get("session_id")
+    if not session_id:
+        return JsonResponse({"error": "Missing session_id"}, status=400)
+
+    try:
+        wait = float(request.GET.get("wait", 0) or 0)
+    except ValueError:
+        return JsonResponse({"error": "Invalid wait"}, status=400)
+    wait = max(0.0, min(wait, getattr(settings, "AEGIS_RESULT_MAX_WAIT", 30)))
+
+    rd = get_async_redis()
+    try:
+        processed_key = PROCESSED_KEY.format(session_id=session_id)
+        raw = await rd.get(processed_key)
+        if raw is None and wait > 0:
+            notify_key = NOTIFY_KEY.format(session_id=session_id)
+            if await get_async_redis(blocking=True).blpop(notify_key, timeout=wait):
+                async with rd.pipeline(transaction=False) as pipe:
+                    requeue_notify_token(pipe, notify_key)
+                    await pipe.execute()
+            raw = await rd.get(processed_key)
+
+        if raw is None:
+            return JsonResponse({"status": "pending"}, status=202)
+
+        return JsonResponse({"status": "done", "session_id": session_id, "data": json.loads(raw)}, status=200)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+# ------------------------------------
+# 🔹 3. PATHWAY ANALYTICS ENDPOINTS
+# ------------------------------------
+@_exempt
+async def submit_score(request):
+    """ POST /api/score/ → manually push data for testing """
+    if request.method != "POST":
+        return JsonResponse({"error": "Only POST allowed"}, status=405)
+
+    try:
+        data = json.loads(request.body)
+        if "label" not in data or "score" not in data:
+            return JsonResponse({"error": "Missing 'label' or 'score'"}, status=400)
+
+        pipe = get_async_redis().pipeline(transaction=False)
+        queue_scores(pipe, [{"label": str(data["label"]), "score": float(data["score"])}])
+        await pipe.execute()
+        return JsonResponse({"status": "queued", "data": data}, status=202)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
+
+
+async def get_all_stats(request):
+    """ GET /api/stats/[?window=1m|5m|1h|24h] → returns all Redis-stored analytics """
+    if request.method != "GET":
+        return JsonResponse({"error": "Only GET allowed"}, status=405)
+
+    window = request.GET.get("window")
+    if window and window not in WINDOWS:
+        return JsonResponse({"error": f"Unknown window, expected one of {list(WINDOWS)}"}, status=400)
+
+    try:
+        pipe = get_async_redis().pipeline(transaction=False)
+        if window:
+            starts, keys = window_bucket_keys(window)
+            for key in keys:
+                pipe.hgetall(key)
+            return JsonResponse(build_window_response(window, starts, await pipe.execute()), status=200)
+
+        pipe.hgetall(GLOBAL_STATS_KEY)
+        pipe.hgetall(LABEL_STATS_KEY)
+        global_data, label_data = await pipe.execute()
+        return JsonResponse(build_stats_response(global_data, label_data), status=200)
+    except Exception as e:
+        return JsonResponse({"error": str(e)}, status=500)
@@ -0,0 +1,73 @@
+# ML_api/streams.py
+"""
+Server-Sent Events delivery of processed results.
+
+Routed only with AEGIS_ASYNC_VIEWS=1 and served through core/asgi.py
+(e.g. `uvicorn core.asgi:application`): the view is async and waits on
+Redis without holding a worker thread.
+"""
+
+import json
+import time
+
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+
+from ml_service.redis_client import NOTIFY_KEY, PROCESSED_KEY, get_async_redis, requeue_notify_token
+
+KEEPALIVE_SECONDS = 15
+
+
+def _sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+async def _result_events(session_ids, timeout):
+    rd = get_async_redis()
+    waiter = get_async_redis(blocking=True)
+    pending = set(session_ids)
+    deadline = time.monotonic() + timeout
+
+    while pending:
+        # Results that are already stored go out immediately.
+        for session_id in list(pending):
+            raw = await rd.get(PROCESSED_KEY.format(session_id=session_id))
+            if raw is not None:
+                pending.discard(session_id)
+                yield _sse("result", {"session_id": session_id, "data": json.loads(raw)})
+        if not pending:
+            break
+
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            yield _sse("timeout", {"pending": sorted(pending)})
+            break
+
+        keys = [NOTIFY_KEY.format(session_id=s) for s in pending]
+        popped = await waiter.blpop(keys, timeout=min(remaining, KEEPALIVE_SECONDS))
+        if popped is None:
+            yield ": keepalive\n\n"
+        else:
+            async with rd.pipeline(transaction=False) as pipe:
+                requeue_notify_token(pipe, popped[0])  # leave the token for other listeners
+                await pipe.execute()
+
+
+async def results_stream(request):
+    """
+    GET /api/results/stream/?session_id=a,b,c
+    Pushes one `result` event per session as soon as it is processed, then
+    closes; a `timeout` event lists sessions still pending at the deadline.
+    """
+    if request.method != "GET":
+        return JsonResponse({"error": "Only GET allowed"}, status=405)
+
+    session_ids = [s.strip() for s in request.GET.get("session_id", "").split(",") if s.strip()]
+    if not session_ids:
+        return JsonResponse({"error": "Missing session_id"}, status=400)
+
+    timeout = getattr(settings, "AEGIS_RESULT_MAX_WAIT", 30)
+    response = StreamingHttpResponse(_result_events(session_ids, timeout), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
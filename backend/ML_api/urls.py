@@ -1,13 +1,29 @@
 # ML_api/urls.py
+from django.conf import settings
 from django.urls import path
 from . import views
 
+# AEGIS_ASYNC_VIEWS=1 serves the core endpoints from async_views (run via core/asgi.py).
+ASYNC_VIEWS = getattr(settings, "AEGIS_ASYNC_VIEWS", False)
+if ASYNC_VIEWS:
+    from . import async_views as api, streams
+else:
+    api = views
+
 urlpatterns = [
     # --- Core ML APIs ---
-    path("analyze/", views.analyze_endpoint, name="analyze"),
-    path("get_results/", views.get_results, name="get_results"),
+    path("analyze/", api.analyze_endpoint, name="analyze"),
+    path("get_results/", api.get_results, name="get_results"),
 
     # --- Pathway + Redis Analytics APIs ---
-    path("score/", views.submit_score, name="submit_score"),
-    path("stats/", views.get_all_stats, name="get_all_stats"),
+    path("score/", api.submit_score, name="submit_score"),
+    path("stats/", api.get_all_stats, name="get_all_stats"),
+
+    # --- Model registry status ---
+    path("models/", views.model_status, name="model_status"),
 ]
+
+# The SSE stream holds a connection open per client; it is only served
+# under ASGI, where it does not tie up a worker thread.
+if ASYNC_VIEWS:
+    urlpatterns.append(path("results/stream/", streams.results_stream, name="results_stream"))
@@ -4,10 +4,17 @@ from django.http import JsonResponse
 from rest_framework.decorators import api_view
 from rest_framework.response import Response
 from rest_framework import status
-from ml_service.pii_detection import detect_pii
-from ml_service.redis_client import push_to_queue, fetch_processed_result
-import base64
-import json, redis
+from ml_service.pii_detection import detect_pii, batching_stats, chunk_cache_stats, result_cache_stats
+from ml_service.redis_client import (
+    GLOBAL_STATS_KEY,   # Pathway global stats hash
+    LABEL_STATS_KEY,    # Pathway per-label stats hash
+    BUCKET_GLOBAL_FIELD, BUCKET_KEY,   # Pathway time-bucket series
+    get_redis, publish_result, push_job, queue_scores, wait_for_processed_result
+)
+from ml_service.model_registry import registry
+from ml_service.ingest import UploadRejected, decode_base64, read_upload
+import json
+import time
 from django.conf import settings
 from django.views.decorators.csrf import csrf_exempt
 
@@ -16,12 +23,7 @@ from django.views.decorators.csrf import csrf_exempt
 # 🔹 REDIS CONNECTION SETUP (shared)
 # ------------------------------------
 try:
-    rd = redis.Redis(
-        host=getattr(settings, "REDIS_HOST", "localhost"),
-        port=getattr(settings, "REDIS_PORT", 6379),
-        db=getattr(settings, "REDIS_DB", 0),
-        decode_responses=True
-    )
+    rd = get_redis()
     rd.ping()
     print("[AEGIS Backend] ✅ Connected to Redis successfully.")
 except Exception as e:
@@ -29,24 +31,6 @@ except Exception as e:
     rd = None
 
 
-# Keys for different systems
-SCORE_STREAM_KEY = "scores_stream"      # For Pathway analytics
-RESULT_QUEUE_KEY = "aegis:results"      # For consumer.py engine
-STATS_BY_LABEL_KEY = "stats_by_label"   # Analytics summary cache
-
-GLOBAL_KEYS = [
-    "current_average",
-    "highest_score",
-    "lowest_score",
-    "total_scores",
-    "unique_label_count",
-    "percent_high_score",
-    "count_low",
-    "count_medium",
-    "count_high",
-]
-
-
 # ------------------------------------
 # 🔹 1. TEXT / IMAGE ANALYZE ENDPOINT
 # ------------------------------------
@@ -58,8 +42,10 @@ def analyze_endpoint(request):
       - text: string
       - image: file (optional)
       - image_base64: optional fallback
+      - async: "1" to only enqueue the input (default: settings.AEGIS_ASYNC_ANALYZE)
     Returns:
       - {"status": "queued", "session_id": "...", "pathway_pushed": <n>}
+      - async mode: {"status": "queued", "session_id": "..."} (poll /api/get_results/)
     """
 
     if not rd:
@@ -73,47 +59,35 @@ def analyze_endpoint(request):
         text = data.get("text", "").strip()
         image = request.FILES.get("image", None)
         image_base64 = data.get("image_base64", None)
-        result = None
-
-        # 🧠 Case 1: Text
-        if text:
-            result = detect_pii(text)
-
-        # 🖼️ Case 2: Uploaded image
-        elif image:
-            image_bytes = image.read()
-            result = detect_pii(image_bytes)
-
-        # 🧩 Case 3: Base64-encoded screenshot
-        elif image_base64:
-            try:
-                if "," in image_base64:
-                    image_base64 = image_base64.split(",", 1)[1]
-                image_bytes = base64.b64decode(image_base64)
-                result = detect_pii(image_bytes)
-            except Exception as e:
+        async_mode = str(data.get("async", request.GET.get("async", ""))).lower() in ("1", "true")
+        async_mode = async_mode or getattr(settings, "AEGIS_ASYNC_ANALYZE", False)
+
+        # 📥 Uploads are size-checked, type-sniffed and read into one buffer
+        try:
+            if text:
+                payload = text
+            elif image:
+                payload = read_upload(image)
+            elif image_base64:
+                payload = decode_base64(image_base64)
+            else:
                 return Response(
-                    {"error": f"Invalid base64 image: {e}"},
+                    {"error": "No text or image provided."},
                     status=status.HTTP_400_BAD_REQUEST
                 )
+        except UploadRejected as e:
+            return Response({"error": str(e)}, status=e.status)
 
-        # 🚫 Case 4: No input
-        else:
-            return Response(
-                {"error": "No text or image provided."},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        # ⏩ Async mode: store the raw input, let inference workers do the rest
+        if async_mode:
+            session_id = push_job("text" if text else "file", payload)
+            return JsonResponse({"status": "queued", "session_id": session_id}, status=202)
 
-        # 🧾 Queue to Consumer
-        session_id = push_to_queue(result)
+        # 🧠 Text, 🖼️ uploaded image or 🧩 base64-encoded screenshot
+        result = detect_pii(payload)
 
-        # 🚀 Push each detection to Pathway stream
-        pathway_push_count = 0
-        if isinstance(result, list):
-            for item in result:
-                if isinstance(item, dict) and "label" in item and "score" in item:
-                    rd.rpush(SCORE_STREAM_KEY, json.dumps(item))
-                    pathway_push_count += 1
+        # 🧾 Queue to Consumer + 🚀 push each detection to Pathway stream (one round trip)
+        session_id, pathway_push_count = publish_result(result)
 
         return JsonResponse({
             "status": "queued",
@@ -131,6 +105,11 @@ def analyze_endpoint(request):
 # ------------------------------------
 @api_view(['GET'])
 def get_results(request):
+    """
+    Endpoint: /api/get_results/?session_id=...&wait=<seconds>
+    With `wait`, blocks until the result is stored or the timeout passes
+    (capped at settings.AEGIS_RESULT_MAX_WAIT) instead of returning 202 at once.
+    """
     session_id = request.GET.get("session_id")
 
     if not session_id:
@@ -140,7 +119,13 @@ def get_results(request):
         )
 
     try:
-        data = fetch_processed_result(session_id)
+        wait = float(request.GET.get("wait", 0) or 0)
+    except ValueError:
+        return Response({"error": "Invalid wait"}, status=status.HTTP_400_BAD_REQUEST)
+    wait = max(0.0, min(wait, getattr(settings, "AEGIS_RESULT_MAX_WAIT", 30)))
+
+    try:
+        data = wait_for_processed_result(session_id, wait)
 
         if not data:
             return Response({"status": "pending"}, status=status.HTTP_202_ACCEPTED)
@@ -171,10 +156,9 @@ def submit_score(request):
         if "label" not in data or "score" not in data:
             return JsonResponse({"error": "Missing 'label' or 'score'"}, status=400)
 
-        rd.rpush(SCORE_STREAM_KEY, json.dumps({
-            "label": str(data["label"]),
-            "score": float(data["score"])
-        }))
+        pipe = rd.pipeline(transaction=False)
+        queue_scores(pipe, [{"label": str(data["label"]), "score": float(data["score"])}])
+        pipe.execute()
 
         return JsonResponse({"status": "queued", "data": data}, status=202)
     except Exception as e:
@@ -182,39 +166,140 @@ def submit_score(request):
 
 
 def get_all_stats(request):
-    """ GET /api/stats/ → returns all Redis-stored analytics """
+    """
+    GET /api/stats/ → returns all Redis-stored analytics
+    GET /api/stats/?window=1m|5m|1h|24h → the same, over the precomputed time buckets
+    """
     if request.method != "GET":
         return JsonResponse({"error": "Only GET allowed"}, status=405)
     if not rd:
         return JsonResponse({"error": "Redis not connected"}, status=503)
 
-    try:
-        global_values = rd.mget(GLOBAL_KEYS)
-        global_data = dict(zip(GLOBAL_KEYS, global_values))
-        stats_by_label_raw = rd.get(STATS_BY_LABEL_KEY)
-        stats_by_label = json.loads(stats_by_label_raw) if stats_by_label_raw else {}
-
-        def to_num(val, num_type=float):
-            try:
-                return num_type(val) if val is not None else 0
-            except:
-                return 0
-
-        response_data = {
-            "current_average": to_num(global_data.get("current_average")),
-            "highest_score": to_num(global_data.get("highest_score")),
-            "lowest_score": to_num(global_data.get("lowest_score")),
-            "total_scores": to_num(global_data.get("total_scores"), int),
-            "unique_label_count": to_num(global_data.get("unique_label_count"), int),
-            "percent_high_score": to_num(global_data.get("percent_high_score")),
-            "distribution": {
-                "low": to_num(global_data.get("count_low"), int),
-                "medium": to_num(global_data.get("count_medium"), int),
-                "high": to_num(global_data.get("count_high"), int),
-            },
-            "stats_by_label": stats_by_label
-        }
+    window = request.GET.get("window")
+    if window and window not in WINDOWS:
+        return JsonResponse({"error": f"Unknown window, expected one of {list(WINDOWS)}"}, status=400)
 
-        return JsonResponse(response_data, status=200)
+    try:
+        if window:
+            starts, keys = window_bucket_keys(window)
+            pipe = rd.pipeline(transaction=False)
+            for key in keys:
+                pipe.hgetall(key)
+            return JsonResponse(build_window_response(window, starts, pipe.execute()), status=200)
+
+        pipe = rd.pipeline(transaction=False)
+        pipe.hgetall(GLOBAL_STATS_KEY)
+        pipe.hgetall(LABEL_STATS_KEY)
+        global_data, label_data = pipe.execute()
+        return JsonResponse(build_stats_response(global_data, label_data), status=200)
     except Exception as e:
         return JsonResponse({"error": str(e)}, status=500)
+
+
+def build_stats_response(global_data, label_data):
+    """Shape the stats:global and stats:by_label hashes into the /api/stats/ payload (shared with async_views)."""
+    stats_by_label = {label: json.loads(row) for label, row in label_data.items()}
+
+    def to_num(val, num_type=float):
+        try:
+            return num_type(val) if val is not None else 0
+        except:
+            return 0
+
+    return {
+        "current_average": to_num(global_data.get("current_average")),
+        "highest_score": to_num(global_data.get("highest_score")),
+        "lowest_score": to_num(global_data.get("lowest_score")),
+        "total_scores": to_num(global_data.get("total_scores"), int),
+        "unique_label_count": to_num(global_data.get("unique_label_count"), int),
+        "percent_high_score": to_num(global_data.get("percent_high_score")),
+        "score_quantiles": {
+            "p50": to_num(global_data.get("score_p50")),
+            "p95": to_num(global_data.get("score_p95")),
+            "p99": to_num(global_data.get("score_p99")),
+        },
+        "distinct_sessions": to_num(global_data.get("distinct_sessions"), int),
+        "distribution": {
+            "low": to_num(global_data.get("count_low"), int),
+            "medium": to_num(global_data.get("count_medium"), int),
+            "high": to_num(global_data.get("count_high"), int),
+        },
+        "stats_by_label": stats_by_label
+    }
+
+
+# window -> (bucket seconds, number of buckets); see pathway_engine.pipeline.bucket_stats.
+# The newest bucket is still filling, so short windows use 10 s buckets to
+# keep that partial share small (a single 60 s bucket could hold ~0 s of data).
+WINDOWS = {
+    "1m": (10, 6),
+    "5m": (10, 30),
+    "1h": (60, 60),
+    "24h": (3600, 24),
+}
+
+
+def window_bucket_keys(window, now=None):
+    """Bucket start times (oldest first) and Redis keys covering `window`, current bucket included."""
+    seconds, count = WINDOWS[window]
+    current = int((now or time.time()) // seconds) * seconds
+    starts = [current - i * seconds for i in range(count - 1, -1, -1)]
+    return starts, [BUCKET_KEY.format(seconds=seconds, start=start) for start in starts]
+
+
+def build_window_response(window, starts, buckets):
+    """Merge per-bucket rows (count/sum/min/max) into window totals plus a series (shared with async_views)."""
+    totals = {}
+    series = []
+
+    for start, bucket in zip(starts, buckets):
+        rows = {field: json.loads(raw) for field, raw in bucket.items()}
+        overall = rows.get(BUCKET_GLOBAL_FIELD, {})
+        series.append({
+            "start": start,
+            "count": overall.get("count", 0),
+            "avg_score": overall["sum_score"] / overall["count"] if overall.get("count") else 0,
+        })
+        for field, row in rows.items():
+            agg = totals.setdefault(field, {"count": 0, "sum_score": 0.0, "count_high": 0})
+            agg["count"] += row["count"]
+            agg["sum_score"] += row["sum_score"]
+            agg["count_high"] += row["count_high"]
+            agg["max_score"] = max(agg.get("max_score", row["max_score"]), row["max_score"])
+            agg["min_score"] = min(agg.get("min_score", row["min_score"]), row["min_score"])
+
+    def summarize(agg):
+        count = agg["count"]
+        return {
+            "count": count,
+            "avg_score": agg["sum_score"] / count if count else 0,
+            "max_score": agg.get("max_score", 0),
+            "min_score": agg.get("min_score", 0),
+            "percent_high_score": agg["count_high"] / count * 100 if count else 0,
+        }
+
+    overall = totals.pop(BUCKET_GLOBAL_FIELD, {"count": 0, "sum_score": 0.0, "count_high": 0})
+    return {
+        "window": window,
+        "bucket_seconds": WINDOWS[window][0],
+        **summarize(overall),
+        "unique_label_count": len(totals),
+        "stats_by_label": {label: summarize(agg) for label, agg in totals.items()},
+        "series": series,
+    }
+
+
+# ------------------------------------
+# 🔹 4. MODEL REGISTRY STATUS
+# ------------------------------------
+def model_status(request):
+    """ GET /api/models/ → per-model load state, memory, batching and cache metrics """
+    if request.method != "GET":
+        return JsonResponse({"error": "Only GET allowed"}, status=405)
+
+    return JsonResponse({
+        "models": registry.stats(),
+        "batching": batching_stats(),
+        "result_cache": result_cache_stats(),
+        "chunk_cache": chunk_cache_stats(),
+    }, status=200)
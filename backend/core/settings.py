@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -123,6 +124,32 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Redis config for Pathway and analytics
-REDIS_HOST = "localhost"
-REDIS_PORT = 6379
-REDIS_DB = 0
\ No newline at end of file
+REDIS_HOST = os.environ.get("REDIS_HOST", "localhost")
+REDIS_PORT = int(os.environ.get("REDIS_PORT", "6379"))
+REDIS_DB = int(os.environ.get("REDIS_DB", "0"))
+# Per-process pool sizes. REDIS_MAX_CONNECTIONS covers ordinary commands:
+# at least the worker's thread count (plus AEGIS_INFERENCE_THREADS under
+# ASGI). Long-polls (?wait=) and SSE streams each hold one connection from
+# the separate REDIS_BLOCKING_MAX_CONNECTIONS pool for their whole wait, so
+# size that to the concurrent waiters expected. Callers wait up to
+# REDIS_POOL_TIMEOUT seconds for a free connection before erroring.
+REDIS_MAX_CONNECTIONS = int(os.environ.get("REDIS_MAX_CONNECTIONS", "64"))
+REDIS_BLOCKING_MAX_CONNECTIONS = int(os.environ.get("REDIS_BLOCKING_MAX_CONNECTIONS", "256"))
+REDIS_POOL_TIMEOUT = float(os.environ.get("REDIS_POOL_TIMEOUT", "5"))
+
+# Async analyze: /api/analyze/ only enqueues raw input and returns a session_id;
+# run `python -m ml_service.inference_worker` to process the jobs.
+AEGIS_ASYNC_ANALYZE = os.environ.get("AEGIS_ASYNC_ANALYZE", "0") == "1"
+
+# Upper bound for /api/get_results/?wait= long-polls and SSE streams (seconds).
+AEGIS_RESULT_MAX_WAIT = float(os.environ.get("AEGIS_RESULT_MAX_WAIT", "30"))
+
+# Async-native API views (ML_api/async_views.py), served through core/asgi.py.
+# AEGIS_INFERENCE_THREADS bounds concurrent detect_pii calls per process.
+AEGIS_ASYNC_VIEWS = os.environ.get("AEGIS_ASYNC_VIEWS", "0") == "1"
+AEGIS_INFERENCE_THREADS = int(os.environ.get("AEGIS_INFERENCE_THREADS", "4"))
+
+# Upload limits: ml_service.ingest rejects files above AEGIS_MAX_UPLOAD_BYTES;
+# request bodies may carry that much as base64 (4/3 larger) plus form fields.
+AEGIS_MAX_UPLOAD_BYTES = int(os.environ.get("AEGIS_MAX_UPLOAD_BYTES", str(20 * 1024 * 1024)))
+DATA_UPLOAD_MAX_MEMORY_SIZE = AEGIS_MAX_UPLOAD_BYTES * 4 // 3 + 64 * 1024
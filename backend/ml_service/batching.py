@@ -0,0 +1,130 @@
+# ml_service/batching.py
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+
+# ------------------------------
+# Helper: Fixed-Bucket Histogram
+# ------------------------------
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = list(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # last slot is +Inf
+        self.total = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        with self._lock:
+            for i, upper in enumerate(self.buckets):
+                if value <= upper:
+                    self.counts[i] += 1
+                    break
+            else:
+                self.counts[-1] += 1
+            self.total += 1
+            self.sum += value
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            labels = [f"<={b}" for b in self.buckets] + [f">{self.buckets[-1]}"]
+            return {
+                "count": self.total,
+                "mean": round(self.sum / self.total, 3) if self.total else 0,
+                "buckets": dict(zip(labels, self.counts)),
+            }
+
+
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+QUEUE_DELAY_MS_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 250, 500, 1000)
+
+
+# ------------------------------
+# Micro-Batcher
+# ------------------------------
+class MicroBatcher:
+    """
+    Collects items submitted from concurrent request threads and runs them
+    through `batch_fn` together.
+
+    A batch is dispatched once `max_batch_size` items are pending or the
+    oldest item has waited `max_wait_ms`. `batch_fn(items)` must return one
+    result per item, in order; each caller gets its own Future back.
+    """
+
+    def __init__(self, name, batch_fn, max_batch_size=16, max_wait_ms=5):
+        self.name = name
+        self.batch_fn = batch_fn
+        self.max_batch_size = max(int(max_batch_size), 1)
+        self.max_wait = max(float(max_wait_ms), 0.0) / 1000.0
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self.batch_sizes = Histogram(BATCH_SIZE_BUCKETS)
+        self.queue_delay_ms = Histogram(QUEUE_DELAY_MS_BUCKETS)
+
+    def _ensure_started(self):
+        # Started lazily so importing the module never spawns threads
+        # (keeps fork-based worker pools safe).
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name=f"batcher-{self.name}", daemon=True)
+            self._thread.start()
+
+    def submit(self, item) -> Future:
+        return self.submit_many([item])[0]
+
+    def submit_many(self, items) -> list:
+        futures = [Future() for _ in items]
+        now = time.monotonic()
+        with self._cond:
+            self._ensure_started()
+            for item, future in zip(items, futures):
+                self._pending.append((item, future, now))
+            self._cond.notify()
+        return futures
+
+    def _next_batch(self):
+        with self._cond:
+            while not self._pending:
+                self._cond.wait()
+            deadline = self._pending[0][2] + self.max_wait
+            while len(self._pending) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            size = min(len(self._pending), self.max_batch_size)
+            return [self._pending.popleft() for _ in range(size)]
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            started = time.monotonic()
+            self.batch_sizes.observe(len(batch))
+            for _, _, enqueued in batch:
+                self.queue_delay_ms.observe((started - enqueued) * 1000.0)
+
+            items = [item for item, _, _ in batch]
+            try:
+                results = self.batch_fn(items)
+                if len(results) != len(items):
+                    raise RuntimeError(f"{self.name}: batch_fn returned {len(results)} results for {len(items)} items")
+            except Exception as e:
+                print(f"[Batcher {self.name}] Batch of {len(items)} failed: {e}")
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+
+            for (_, future, _), result in zip(batch, results):
+                future.set_result(result)
+
+    def stats(self) -> dict:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000.0,
+            "pending": len(self._pending),
+            "batch_size": self.batch_sizes.snapshot(),
+            "queue_delay_ms": self.queue_delay_ms.snapshot(),
+        }
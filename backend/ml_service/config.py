@@ -0,0 +1,43 @@
+# ml_service/config.py
+import os
+
+
+# ------------------------------
+# Environment-driven settings
+# ------------------------------
+# ml_service is imported both by Django and by standalone workers, so its
+# knobs come from AEGIS_* environment variables rather than core.settings.
+
+def env_str(name: str, default: str = "") -> str:
+    value = os.environ.get(name)
+    return value.strip() if value is not None else default
+
+
+def env_int(name: str, default: int = 0) -> int:
+    try:
+        return int(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        print(f"[Config] Invalid integer for {name}, using {default}")
+        return default
+
+
+def env_float(name: str, default: float = 0.0) -> float:
+    try:
+        return float(os.environ.get(name, default))
+    except (TypeError, ValueError):
+        print(f"[Config] Invalid float for {name}, using {default}")
+        return default
+
+
+def env_bool(name: str, default: bool = False) -> bool:
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def env_list(name: str, default=None) -> list:
+    value = os.environ.get(name)
+    if value is None:
+        return list(default or [])
+    return [item.strip() for item in value.split(",") if item.strip()]
@@ -0,0 +1,138 @@
+# ml_service/fused_classifier.py
+import copy
+import filecmp
+import json
+import os
+import shutil
+
+from torch import nn
+from safetensors.torch import load_file, save_file
+from transformers import RobertaConfig, RobertaModel, RobertaForSequenceClassification, RobertaTokenizerFast
+from transformers.models.roberta.modeling_roberta import RobertaClassificationHead
+
+HEADS_FILE = "fused_heads.json"
+WEIGHTS_FILE = "model.safetensors"
+TOKENIZER_FILES = ["vocab.json", "merges.txt", "tokenizer_config.json", "special_tokens_map.json", "tokenizer.json"]
+
+
+# ------------------------------
+# Fused Model
+# ------------------------------
+def _head_config(config, spec):
+    head_config = copy.deepcopy(config)
+    head_config.num_labels = len(spec["id2label"])
+    return head_config
+
+
+class FusedRobertaClassifier(nn.Module):
+    """
+    One RoBERTa encoder with several sequence-classification heads.
+
+    Each head is a RobertaClassificationHead copied from a fine-tuned
+    RobertaForSequenceClassification, so one encoder pass serves every
+    classifier. `forward` returns {head_name: logits}.
+    """
+
+    def __init__(self, config: RobertaConfig, head_specs: dict):
+        super().__init__()
+        self.config = config
+        self.head_specs = head_specs
+        self.roberta = RobertaModel(config, add_pooling_layer=False)
+        self.heads = nn.ModuleDict({
+            name: RobertaClassificationHead(_head_config(config, spec))
+            for name, spec in head_specs.items()
+        })
+
+    @property
+    def device(self):
+        return next(self.parameters()).device
+
+    def forward(self, input_ids, attention_mask=None):
+        hidden = self.roberta(input_ids=input_ids, attention_mask=attention_mask)[0]
+        return {name: head(hidden) for name, head in self.heads.items()}
+
+
+class FusedClassifier:
+    """Model + tokenizer pair, shaped like inference_backend.SequenceClassifier."""
+
+    def __init__(self, model: FusedRobertaClassifier, tokenizer):
+        self.model = model
+        self.tokenizer = tokenizer
+
+
+# ------------------------------
+# Build / Load
+# ------------------------------
+def _check_compatible(name, config, base):
+    for field in ("model_type", "hidden_size", "num_hidden_layers", "num_attention_heads", "vocab_size"):
+        if getattr(config, field) != getattr(base, field):
+            raise ValueError(f"Head '{name}' differs from backbone in {field}")
+
+
+def build_fused_checkpoint(head_paths: dict, output_dir: str, backbone: str = None) -> dict:
+    """
+    Fuse several RobertaForSequenceClassification checkpoints into one.
+
+    The encoder comes from `backbone` (default: the first head); every
+    model contributes its classification head. Tokenizer files must match.
+    Returns the head specs written to fused_heads.json.
+    """
+    if not head_paths:
+        raise ValueError("At least one head checkpoint is required")
+    backbone = backbone or next(iter(head_paths))
+    if backbone not in head_paths:
+        raise ValueError(f"Backbone '{backbone}' is not one of {list(head_paths)}")
+
+    models = {name: RobertaForSequenceClassification.from_pretrained(path) for name, path in head_paths.items()}
+    base_config = models[backbone].config
+    backbone_path = head_paths[backbone]
+
+    head_specs = {}
+    for name, model in models.items():
+        _check_compatible(name, model.config, base_config)
+        for fname in ("vocab.json", "merges.txt"):
+            if not filecmp.cmp(os.path.join(head_paths[name], fname), os.path.join(backbone_path, fname), shallow=False):
+                raise ValueError(f"Head '{name}' uses a different {fname} than the backbone")
+        head_specs[name] = {
+            "id2label": {int(k): v for k, v in model.config.id2label.items()},
+            "problem_type": model.config.problem_type,
+            "source": os.path.abspath(head_paths[name]),
+        }
+
+    fused = FusedRobertaClassifier(base_config, head_specs)
+    fused.roberta.load_state_dict(models[backbone].roberta.state_dict())
+    for name, model in models.items():
+        fused.heads[name].load_state_dict(model.classifier.state_dict())
+
+    os.makedirs(output_dir, exist_ok=True)
+    base_config.save_pretrained(output_dir)
+    with open(os.path.join(output_dir, HEADS_FILE), "w") as f:
+        json.dump({"backbone": backbone, "heads": head_specs}, f, indent=2)
+    save_file({k: v.contiguous() for k, v in fused.state_dict().items()}, os.path.join(output_dir, WEIGHTS_FILE))
+    for fname in TOKENIZER_FILES:
+        src = os.path.join(backbone_path, fname)
+        if os.path.exists(src):
+            shutil.copy(src, os.path.join(output_dir, fname))
+
+    return head_specs
+
+
+def load_fused_classifier(path: str) -> FusedClassifier:
+    with open(os.path.join(path, HEADS_FILE)) as f:
+        meta = json.load(f)
+    head_specs = {
+        name: {**spec, "id2label": {int(k): v for k, v in spec["id2label"].items()}}
+        for name, spec in meta["heads"].items()
+    }
+
+    config = RobertaConfig.from_pretrained(path)
+    model = FusedRobertaClassifier(config, head_specs)
+    model.load_state_dict(load_file(os.path.join(path, WEIGHTS_FILE)))
+    model.eval()
+
+    tokenizer = RobertaTokenizerFast.from_pretrained(
+        path,
+        vocab_file=os.path.join(path, "vocab.json"),
+        merges_file=os.path.join(path, "merges.txt")
+    )
+    return FusedClassifier(model, tokenizer)
@@ -1,13 +1,27 @@
-from transformers import AutoTokenizer, AutoModelForSequenceClassification, pipeline
+from ml_service.model_registry import registry
+from ml_service.pii_detection import chunk_token_ids, classify_windows
 
-MODEL_PATH = "backend/ml_service/models/disease_model"
+# The classifier comes from the shared registry, so it follows
+# AEGIS_CLASSIFIER_BACKEND (torch / torch-int8 / onnx / onnx-int8) and is
+# only loaded on first use.
 
-print("Loading Disease Detection model...")
-disease_detector = pipeline("text-classification", model=MODEL_PATH, tokenizer=MODEL_PATH)
 
 def detect_disease(text: str):
     """Run disease detection on input text."""
-    result = disease_detector(text)[0]
+    disease_detector = registry.get("disease")
+    if disease_detector is None:
+        return {"text": text, "error": "Disease model unavailable"}
+
+    # Like the pipeline with truncation: score the first 512-token window.
+    windows = chunk_token_ids(text, disease_detector.tokenizer)[:1]
+    if not windows:
+        return {"text": text, "label": "No Disease", "score": 0.0}
+
+    preds = classify_windows(disease_detector, windows)[0]
+    if preds is None:
+        return {"text": text, "error": "Disease inference failed"}
+
+    result = preds[0]
     label = "Disease Detected" if result["label"] == "LABEL_1" else "No Disease"
     score = round(result["score"], 3)
     return {"text": text, "label": label, "score": score}
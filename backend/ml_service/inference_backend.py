@@ -0,0 +1,137 @@
+# ml_service/inference_backend.py
+import os
+
+import torch
+from transformers import AutoConfig, RobertaTokenizerFast, RobertaForSequenceClassification
+
+from ml_service.config import env_int
+
+# Backends for the sequence classifiers (self-harm, disease):
+#   torch       eager fp32 (default)
+#   torch-int8  torch dynamic int8 quantization of nn.Linear, applied at load
+#   onnx        onnxruntime, fp32 graph exported by tools.export_classifiers
+#   onnx-int8   onnxruntime, dynamically quantized int8 graph
+BACKENDS = ("torch", "torch-int8", "onnx", "onnx-int8")
+ONNX_DIR = "onnx"
+ONNX_FILES = {"onnx": "model.onnx", "onnx-int8": "model.int8.onnx"}
+
+
+class SequenceClassifier:
+    """
+    Model + tokenizer pair used by pii_detection.classify_windows.
+
+    `model(input_ids=..., attention_mask=...)` returns an object with
+    `.logits`, and `model.config` / `model.device` behave like a HF model,
+    whatever the backend underneath.
+    """
+
+    def __init__(self, model, tokenizer, backend):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.backend = backend
+
+
+# ------------------------------
+# ONNX Runtime Wrapper
+# ------------------------------
+class _Output:
+    def __init__(self, logits):
+        self.logits = logits
+
+
+class OnnxSequenceClassificationModel:
+    def __init__(self, onnx_path, config, num_threads=0):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads > 0:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(onnx_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.config = config
+        self.device = torch.device("cpu")
+
+    def __call__(self, input_ids, attention_mask):
+        feeds = {"input_ids": input_ids.cpu().numpy(), "attention_mask": attention_mask.cpu().numpy()}
+        feeds = {k: v for k, v in feeds.items() if k in self.input_names}
+        logits = self.session.run(["logits"], feeds)[0]
+        return _Output(torch.from_numpy(logits))
+
+
+# ------------------------------
+# Loading
+# ------------------------------
+def load_tokenizer(model_path):
+    return RobertaTokenizerFast.from_pretrained(
+        model_path,
+        vocab_file=os.path.join(model_path, "vocab.json"),
+        merges_file=os.path.join(model_path, "merges.txt")
+    )
+
+
+def onnx_path(model_path, backend):
+    return os.path.join(model_path, ONNX_DIR, ONNX_FILES[backend])
+
+
+def load_sequence_classifier(model_path, backend="torch") -> SequenceClassifier:
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown classifier backend '{backend}', expected one of {BACKENDS}")
+
+    tokenizer = load_tokenizer(model_path)
+
+    if backend.startswith("onnx"):
+        path = onnx_path(model_path, backend)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"{path} missing; run `python -m ml_service.tools.export_classifiers` first")
+        config = AutoConfig.from_pretrained(model_path)
+        model = OnnxSequenceClassificationModel(path, config, env_int("AEGIS_ORT_THREADS", 0))
+        return SequenceClassifier(model, tokenizer, backend)
+
+    model = RobertaForSequenceClassification.from_pretrained(model_path)
+    model.eval()
+    if backend == "torch-int8":
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return SequenceClassifier(model, tokenizer, backend)
+
+
+# ------------------------------
+# Export
+# ------------------------------
+def export_onnx(model_path, quantize=True, opset=14) -> list:
+    """
+    Export a RobertaForSequenceClassification checkpoint to
+    <model_path>/onnx/model.onnx (and model.int8.onnx when `quantize`).
+    Returns the written paths.
+    """
+    tokenizer = load_tokenizer(model_path)
+    model = RobertaForSequenceClassification.from_pretrained(model_path)
+    model.config.return_dict = False
+    model.eval()
+
+    os.makedirs(os.path.join(model_path, ONNX_DIR), exist_ok=True)
+    fp32_path = onnx_path(model_path, "onnx")
+    sample = tokenizer("AEGIS export sample text", return_tensors="pt")
+    torch.onnx.export(
+        model,
+        (sample["input_ids"], sample["attention_mask"]),
+        fp32_path,
+        input_names=["input_ids", "attention_mask"],
+        output_names=["logits"],
+        dynamic_axes={
+            "input_ids": {0: "batch", 1: "sequence"},
+            "attention_mask": {0: "batch", 1: "sequence"},
+            "logits": {0: "batch"},
+        },
+        opset_version=opset,
+    )
+    written = [fp32_path]
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+
+        int8_path = onnx_path(model_path, "onnx-int8")
+        quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+        written.append(int8_path)
+
+    return written
@@ -0,0 +1,124 @@
+# ml_service/inference_worker.py
+"""
+Inference workers for the async /api/analyze/ mode.
+
+The web tier only stores raw input (see redis_client.push_job); these
+workers pop jobs, run detect_pii and write aegis:processed:{session_id}.
+
+With --workers N the parent loads the models once and then forks N
+workers, so weights are shared copy-on-write and resident memory stays
+close to one model copy. --threads caps torch/OpenMP/ORT intra-op threads
+per worker (default: cores // workers) to avoid oversubscription.
+
+Usage (from backend/):
+    python -m ml_service.inference_worker [--workers N] [--threads T] [--preload gliner,selfharm,disease]
+"""
+import argparse
+import gc
+import multiprocessing
+import os
+import sys
+import time
+
+from ml_service.config import env_int, env_str
+from ml_service.model_registry import registry
+from ml_service.pii_detection import CLASSIFIER_BACKEND, FUSED_CLASSIFIER, detect_pii
+from ml_service.redis_client import pop_job, store_processed_result
+from pathway_engine.consumer import process_data
+
+THREAD_ENV_VARS = ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "AEGIS_ORT_THREADS")
+
+
+def limit_threads(threads):
+    """Pin intra-op parallelism for this process (and anything it loads later)."""
+    for var in THREAD_ENV_VARS:
+        os.environ[var] = str(threads)
+    if "torch" in sys.modules:
+        import torch
+        torch.set_num_threads(threads)
+
+
+def default_preload():
+    names = ["gliner", "fused"] if FUSED_CLASSIFIER else ["gliner", "selfharm", "disease"]
+    if CLASSIFIER_BACKEND.startswith("onnx"):
+        # onnxruntime sessions do not survive fork(); each worker loads its own.
+        names = [n for n in names if n == "gliner"]
+    return ",".join(names)
+
+
+def handle_job(job, raw_input):
+    session_id = job["session_id"]
+    if raw_input is None:
+        return {"error": "Job input expired before processing.", "timestamp": time.time()}
+
+    result = detect_pii(raw_input)
+    if not isinstance(result, list):
+        return {**(result if isinstance(result, dict) else {"error": str(result)}), "timestamp": time.time()}
+
+    processed = process_data(result)
+    processed["detections"] = result
+    processed["queue_seconds"] = round(time.time() - job.get("submitted_at", time.time()), 3)
+    print(f"[Inference Worker {os.getpid()}] ✔ Processed session {session_id}")
+    return processed
+
+
+def run_worker(worker_id=0, threads=0):
+    if threads:
+        limit_threads(threads)
+    print(f"[Inference Worker {worker_id}] Listening for jobs (pid {os.getpid()})...")
+    while True:
+        try:
+            popped = pop_job(timeout=5)
+            if popped is None:
+                continue
+            job, raw_input = popped
+            processed = handle_job(job, raw_input)
+            store_processed_result(job["session_id"], processed, detections=processed.get("detections"))
+        except KeyboardInterrupt:
+            break
+        except Exception as e:
+            print(f"[Inference Worker {worker_id}] Job failed: {e}")
+            time.sleep(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="AEGIS async inference workers")
+    parser.add_argument("--workers", type=int, default=env_int("AEGIS_WORKERS", 1),
+                        help="number of worker processes")
+    parser.add_argument("--threads", type=int, default=env_int("AEGIS_WORKER_THREADS", 0),
+                        help="intra-op threads per worker (0 = cores // workers)")
+    parser.add_argument("--preload", default=env_str("AEGIS_WORKER_PRELOAD", default_preload()),
+                        help="comma-separated models to load before forking ('' to disable)")
+    args = parser.parse_args()
+
+    workers = max(args.workers, 1)
+    threads = args.threads or max((os.cpu_count() or 1) // workers, 1)
+    limit_threads(threads)
+
+    preload = [name.strip() for name in args.preload.split(",") if name.strip()]
+    if preload:
+        print(f"[Inference Worker] Preloading {', '.join(preload)} before starting {workers} worker(s)...")
+        registry.warm(preload)
+
+    if workers == 1:
+        run_worker(0, threads)
+        return
+
+    # Move everything allocated so far into the permanent GC generation so the
+    # collector in each child does not touch (and un-share) those pages.
+    gc.collect()
+    gc.freeze()
+
+    ctx = multiprocessing.get_context("fork")
+    processes = [ctx.Process(target=run_worker, args=(i, threads), daemon=True) for i in range(workers)]
+    for p in processes:
+        p.start()
+    try:
+        for p in processes:
+            p.join()
+    except KeyboardInterrupt:
+        print("[Inference Worker] Shutting down.")
+
+
+if __name__ == "__main__":
+    main()
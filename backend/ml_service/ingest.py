@@ -0,0 +1,184 @@
+# ml_service/ingest.py
+"""
+Size-bounded upload ingest for /api/analyze/.
+
+Uploaded files and base64 screenshots are read straight into one
+preallocated buffer and returned as a memoryview, which detect_pii,
+PIL (via MemoryViewFile) and poppler consume without further copies.
+Limits are enforced before the work they protect: declared/estimated
+size before reading, MIME type from the first bytes, pixel count from
+the image header before any decode.
+"""
+import binascii
+import io
+import re
+
+import magic
+
+from ml_service.config import env_int
+
+MAX_UPLOAD_BYTES = env_int("AEGIS_MAX_UPLOAD_BYTES", 20 * 1024 * 1024)
+MAX_IMAGE_PIXELS = env_int("AEGIS_MAX_IMAGE_PIXELS", 40_000_000)
+SNIFF_BYTES = 2048
+CHUNK_BYTES = 256 * 1024
+ALLOWED_MIME_PREFIXES = ("image/", "application/pdf")
+
+
+class UploadRejected(ValueError):
+    """Raised for inputs that fail a limit or check; `status` is the HTTP code to return."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+# ------------------------------
+# Checks
+# ------------------------------
+def _check_size(size):
+    if size > MAX_UPLOAD_BYTES:
+        raise UploadRejected(f"Upload too large ({size} bytes, limit {MAX_UPLOAD_BYTES})", status=413)
+
+
+def sniff_mime(head) -> str:
+    mime = (magic.from_buffer(bytes(head[:SNIFF_BYTES]), mime=True) or "").lower()
+    if not mime.startswith(ALLOWED_MIME_PREFIXES):
+        raise UploadRejected(f"Unsupported file type: {mime or 'unknown'}", status=415)
+    return mime
+
+
+def check_image_pixels(view: memoryview):
+    """Reads only the image header (PIL opens lazily) to enforce MAX_IMAGE_PIXELS."""
+    from PIL import Image
+
+    try:
+        with Image.open(MemoryViewFile(view)) as img:
+            width, height = img.size
+    except Exception as e:
+        raise UploadRejected(f"Invalid image: {e}")
+    if width * height > MAX_IMAGE_PIXELS:
+        raise UploadRejected(f"Image too large ({width}x{height}, limit {MAX_IMAGE_PIXELS} pixels)", status=413)
+
+
+def _header_checked(view: memoryview, mime) -> bool:
+    """
+    check_image_pixels on the bytes read so far, so an oversized image is
+    rejected before the rest is read or decoded. False while the header is
+    not complete yet (e.g. a JPEG whose size follows a large EXIF block).
+    """
+    if not mime or not mime.startswith("image/"):
+        return False
+    try:
+        check_image_pixels(view)
+    except UploadRejected as e:
+        if e.status == 413:
+            raise
+        return False
+    return True
+
+
+def _finish(buf: bytearray, length: int, mime: str, checked=False) -> memoryview:
+    view = memoryview(buf)[:length]
+    if mime.startswith("image/") and not checked:
+        check_image_pixels(view)
+    return view
+
+
+# ------------------------------
+# Readers
+# ------------------------------
+def read_upload(upload) -> memoryview:
+    """Django UploadedFile -> memoryview, streamed chunk by chunk into one buffer."""
+    _check_size(upload.size)
+    buf = bytearray(upload.size)
+    view = memoryview(buf)
+    pos = 0
+    mime = None
+    checked = False
+    for chunk in upload.chunks(CHUNK_BYTES):
+        if pos + len(chunk) > len(buf):
+            raise UploadRejected("Upload larger than its declared size", status=413)
+        view[pos:pos + len(chunk)] = chunk
+        pos += len(chunk)
+        if mime is None and pos >= min(SNIFF_BYTES, len(buf)):
+            mime = sniff_mime(view[:pos])
+        if not checked:
+            checked = _header_checked(view[:pos], mime)
+    if mime is None:
+        mime = sniff_mime(view[:pos])
+    return _finish(buf, pos, mime, checked)
+
+
+_DATA_URL = re.compile(r"data:[^,]{0,100},")
+_WHITESPACE = str.maketrans("", "", " \t\r\n")
+
+
+def decode_base64(data: str) -> memoryview:
+    """
+    Base64 (optionally a data: URL) -> memoryview. The decoded size is
+    checked before decoding, the MIME type and image dimensions as soon as
+    the first chunks are decoded, and the string is decoded in slices into
+    one preallocated buffer.
+    """
+    match = _DATA_URL.match(data)
+    start = match.end() if match else 0
+    _check_size((len(data) - start) * 3 // 4)
+
+    buf = bytearray((len(data) - start) * 3 // 4 + 3)
+    view = memoryview(buf)
+    pos = 0
+    mime = None
+    checked = False
+    carry = ""
+    step = CHUNK_BYTES // 3 * 4
+    try:
+        for i in range(start, len(data), step):
+            text = carry + data[i:i + step].translate(_WHITESPACE)
+            usable = len(text) - len(text) % 4 if i + step < len(data) else len(text)
+            text, carry = text[:usable], text[usable:]
+            decoded = binascii.a2b_base64(text)
+            view[pos:pos + len(decoded)] = decoded
+            pos += len(decoded)
+            if mime is None and pos >= SNIFF_BYTES:
+                mime = sniff_mime(view[:pos])
+            if not checked:
+                checked = _header_checked(view[:pos], mime)
+    except binascii.Error as e:
+        raise UploadRejected(f"Invalid base64 image: {e}")
+    if pos == 0:
+        raise UploadRejected("Invalid base64 image: empty payload")
+    if mime is None:
+        mime = sniff_mime(view[:pos])
+    return _finish(buf, pos, mime, checked)
+
+
+# ------------------------------
+# Zero-copy file object
+# ------------------------------
+class MemoryViewFile(io.RawIOBase):
+    """Seekable read-only file over a memoryview (io.BytesIO would copy it)."""
+
+    def __init__(self, view):
+        super().__init__()
+        self._view = memoryview(view).cast("B")
+        self._pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        n = min(len(b), len(self._view) - self._pos)
+        b[:n] = self._view[self._pos:self._pos + n]
+        self._pos += n
+        return n
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self._view)}[whence]
+        self._pos = max(base + offset, 0)
+        return self._pos
+
+    def tell(self):
+        return self._pos
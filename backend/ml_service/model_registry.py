@@ -0,0 +1,177 @@
+# ml_service/model_registry.py
+import gc
+import os
+import threading
+import time
+
+from ml_service.config import env_int
+
+
+# ------------------------------
+# Helper: Memory Accounting
+# ------------------------------
+def _rss_bytes() -> int:
+    """Current resident set size of this process (Linux only, 0 elsewhere)."""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE")
+    except Exception:
+        return 0
+
+
+def _tensor_bytes(obj) -> int:
+    """Bytes held by torch parameters/buffers reachable from a model or pipeline."""
+    module = getattr(obj, "model", obj)
+    if not hasattr(module, "parameters"):
+        return 0
+    try:
+        total = sum(p.numel() * p.element_size() for p in module.parameters())
+        total += sum(b.numel() * b.element_size() for b in module.buffers())
+        return total
+    except Exception:
+        return 0
+
+
+# ------------------------------
+# Model Registry
+# ------------------------------
+class _Entry:
+    def __init__(self, name, loader):
+        self.name = name
+        self.loader = loader
+        self.lock = threading.Lock()
+        self.model = None
+        self.loaded = False
+        self.error = None
+        self.load_seconds = None
+        self.param_bytes = 0
+        self.rss_delta_bytes = 0
+        self.loaded_at = None
+        self.last_used = None
+        self.uses = 0
+
+
+class ModelRegistry:
+    """
+    Loads models on first use instead of at import time.
+
+    Each model is registered with a zero-argument loader. `get(name)` loads
+    it once (thread-safe), returns None if loading failed, and records load
+    time and memory so workers only pay for the models their traffic needs.
+    """
+
+    def __init__(self, idle_seconds: int = 0, reap_interval: int = 30):
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.idle_seconds = idle_seconds
+        self.reap_interval = reap_interval
+        self._last_reap = time.monotonic()
+
+    def register(self, name: str, loader):
+        with self._lock:
+            self._entries[name] = _Entry(name, loader)
+
+    def names(self):
+        return list(self._entries)
+
+    def is_loaded(self, name: str) -> bool:
+        entry = self._entries.get(name)
+        return bool(entry and entry.loaded and entry.model is not None)
+
+    def get(self, name: str):
+        entry = self._entries.get(name)
+        if entry is None:
+            raise KeyError(f"Unknown model '{name}'")
+
+        # model and loaded are read under the lock unload() takes, so a
+        # concurrent unload cannot hand back None for a loaded model.
+        with entry.lock:
+            if not entry.loaded:
+                self._load(entry)
+            model = entry.model
+            entry.last_used = time.monotonic()
+            entry.uses += 1
+
+        self._maybe_unload_idle()
+        return model
+
+    def _load(self, entry: _Entry):
+        print(f"[ModelRegistry] Loading '{entry.name}'...")
+        rss_before = _rss_bytes()
+        started = time.perf_counter()
+        try:
+            entry.model = entry.loader()
+            entry.error = None
+        except Exception as e:
+            print(f"[ModelRegistry] Failed to load '{entry.name}': {e}")
+            entry.model = None
+            entry.error = str(e)
+        entry.load_seconds = round(time.perf_counter() - started, 3)
+        entry.rss_delta_bytes = max(_rss_bytes() - rss_before, 0)
+        entry.param_bytes = _tensor_bytes(entry.model) if entry.model is not None else 0
+        entry.loaded_at = time.time()
+        entry.loaded = True
+        if entry.model is not None:
+            print(f"[ModelRegistry] '{entry.name}' loaded in {entry.load_seconds}s.")
+
+    def warm(self, names):
+        """Eagerly load the given models ("all" loads every registered one)."""
+        if "all" in names:
+            names = self.names()
+        for name in names:
+            if name in self._entries:
+                self.get(name)
+            else:
+                print(f"[ModelRegistry] Cannot warm unknown model '{name}'")
+
+    def unload(self, name: str) -> bool:
+        entry = self._entries.get(name)
+        if entry is None or not entry.loaded:
+            return False
+        with entry.lock:
+            entry.model = None
+            entry.loaded = False
+            entry.error = None
+            entry.param_bytes = 0
+            entry.rss_delta_bytes = 0
+        gc.collect()
+        print(f"[ModelRegistry] Unloaded '{name}'.")
+        return True
+
+    def unload_idle(self, max_idle_seconds: float) -> list:
+        now = time.monotonic()
+        unloaded = []
+        for name, entry in list(self._entries.items()):
+            if entry.loaded and entry.last_used is not None and now - entry.last_used > max_idle_seconds:
+                if self.unload(name):
+                    unloaded.append(name)
+        return unloaded
+
+    def _maybe_unload_idle(self):
+        if self.idle_seconds <= 0:
+            return
+        now = time.monotonic()
+        if now - self._last_reap < self.reap_interval:
+            return
+        self._last_reap = now
+        self.unload_idle(self.idle_seconds)
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        report = {}
+        for name, entry in self._entries.items():
+            report[name] = {
+                "loaded": entry.loaded and entry.model is not None,
+                "error": entry.error,
+                "load_seconds": entry.load_seconds,
+                "param_bytes": entry.param_bytes,
+                "rss_delta_bytes": entry.rss_delta_bytes,
+                "uses": entry.uses,
+                "idle_seconds": round(now - entry.last_used, 1) if entry.last_used else None,
+            }
+        return report
+
+
+# Shared process-wide registry; AEGIS_MODEL_IDLE_SECONDS=0 keeps models forever.
+registry = ModelRegistry(idle_seconds=env_int("AEGIS_MODEL_IDLE_SECONDS", 0))
@@ -0,0 +1,151 @@
+# ml_service/ocr_service.py
+"""
+Batched OCR across concurrent requests and PDF pages.
+
+Detection runs once per image; every detected text line is cut out with a
+perspective warp, and the line crops of all in-flight images go through
+recognition together in large batches. Results are mapped back to their
+image in reading order. Both stages run on MicroBatcher threads, so the
+Paddle predictors are only ever driven from one thread each.
+
+Built on the PaddleOCR 2.x pipeline pinned in requirements.txt: one
+dedicated instance whose ocr() is called with det=True, rec=False for
+boxes and det=False, rec=True on a list of crops for recognition.
+"""
+import numpy as np
+
+from ml_service.batching import MicroBatcher
+from ml_service.config import env_float, env_int, env_str
+from ml_service.model_registry import registry
+
+OCR_DET_MODEL_DIR = env_str("AEGIS_OCR_DET_MODEL_DIR")  # "" = PaddleOCR default
+OCR_REC_MODEL_DIR = env_str("AEGIS_OCR_REC_MODEL_DIR")
+DET_MAX_BATCH = env_int("AEGIS_OCR_DET_BATCH", 8)
+REC_MAX_BATCH = env_int("AEGIS_OCR_REC_BATCH", 64)
+OCR_MAX_WAIT_MS = env_float("AEGIS_OCR_MAX_WAIT_MS", 10.0)
+MIN_REC_SCORE = env_float("AEGIS_OCR_MIN_SCORE", 0.0)
+
+
+# ------------------------------
+# Models
+# ------------------------------
+def _load_ocr_batch():
+    from paddleocr import PaddleOCR
+
+    kwargs = {"lang": "en", "use_angle_cls": False, "rec_batch_num": REC_MAX_BATCH, "show_log": False}
+    if OCR_DET_MODEL_DIR:
+        kwargs["det_model_dir"] = OCR_DET_MODEL_DIR
+    if OCR_REC_MODEL_DIR:
+        kwargs["rec_model_dir"] = OCR_REC_MODEL_DIR
+    return PaddleOCR(**kwargs)
+
+
+# Separate from the "ocr" engine pool: the batcher threads own this instance.
+registry.register("ocr_batch", _load_ocr_batch)
+
+
+def _ocr_model():
+    ocr = registry.get("ocr_batch")
+    if ocr is None:
+        raise RuntimeError("OCR model unavailable")
+    return ocr
+
+
+# ------------------------------
+# Line Crops
+# ------------------------------
+def _quad(poly) -> np.ndarray:
+    import cv2
+
+    pts = np.asarray(poly, dtype=np.float32).reshape(-1, 2)
+    if len(pts) != 4:
+        pts = cv2.boxPoints(cv2.minAreaRect(pts))
+    # order: top-left, top-right, bottom-right, bottom-left
+    s, d = pts.sum(axis=1), np.diff(pts, axis=1).ravel()
+    return np.float32([pts[s.argmin()], pts[d.argmin()], pts[s.argmax()], pts[d.argmax()]])
+
+
+def crop_line(image: np.ndarray, poly):
+    """Perspective-rectified crop of one text line; tall crops are turned upright."""
+    import cv2
+
+    quad = _quad(poly)
+    width = int(round(max(np.linalg.norm(quad[0] - quad[1]), np.linalg.norm(quad[3] - quad[2]))))
+    height = int(round(max(np.linalg.norm(quad[0] - quad[3]), np.linalg.norm(quad[1] - quad[2]))))
+    if width < 2 or height < 2:
+        return None
+    target = np.float32([[0, 0], [width, 0], [width, height], [0, height]])
+    crop = cv2.warpPerspective(
+        image, cv2.getPerspectiveTransform(quad, target), (width, height),
+        flags=cv2.INTER_CUBIC, borderMode=cv2.BORDER_REPLICATE
+    )
+    if height >= 1.5 * width:
+        crop = np.rot90(crop)
+    return crop
+
+
+def reading_order(polys, line_tolerance=10):
+    """Top-to-bottom, then left-to-right, treating boxes within `line_tolerance` px as one line."""
+    boxes = [np.asarray(p, dtype=np.float32).reshape(-1, 2) for p in polys]
+    return sorted(boxes, key=lambda b: (int(b[:, 1].min() // line_tolerance), float(b[:, 0].min())))
+
+
+# ------------------------------
+# Batched Stages
+# ------------------------------
+# A batch mixes images and crops from unrelated requests, so a failure on
+# one item is logged and yields an empty result for that item only, as the
+# per-request path did, instead of failing every future in the batch.
+def _detect_one(ocr, image):
+    try:
+        return ocr.ocr(image, det=True, rec=False, cls=False)[0] or []
+    except Exception as e:
+        print(f"OCR detection failed for one image: {e}")
+        return []
+
+
+def _detect_batch(images):
+    ocr = _ocr_model()
+    # Images differ in size, so detection stays one image per forward pass;
+    # ocr() returns [boxes] per call, with None when nothing was found.
+    return [_detect_one(ocr, image) for image in images]
+
+
+def _recognize_batch(crops):
+    ocr = _ocr_model()
+    try:
+        # A list input with det=False is recognized in rec_batch_num-sized batches.
+        results = ocr.ocr(list(crops), det=False, rec=True, cls=False)[0] or []
+        if len(results) == len(crops):
+            return [(text, float(score)) for text, score in results]
+        print(f"OCR recognition returned {len(results)} results for {len(crops)} crops; retrying one by one")
+    except Exception as e:
+        print(f"OCR recognition batch failed ({e}); retrying one by one")
+    return [_recognize_one(ocr, crop) for crop in crops]
+
+
+def _recognize_one(ocr, crop):
+    try:
+        [(text, score)] = ocr.ocr([crop], det=False, rec=True, cls=False)[0]
+        return text, float(score)
+    except Exception as e:
+        print(f"OCR recognition failed for one crop: {e}")
+        return "", 0.0
+
+
+_det_batcher = MicroBatcher("ocr_det", _detect_batch, DET_MAX_BATCH, OCR_MAX_WAIT_MS)
+_rec_batcher = MicroBatcher("ocr_rec", _recognize_batch, REC_MAX_BATCH, OCR_MAX_WAIT_MS)
+
+
+def recognize_image(image: np.ndarray) -> str:
+    """OCR one image; safe to call from many threads at once."""
+    polys = _det_batcher.submit(image).result()
+    crops = [c for c in (crop_line(image, p) for p in reading_order(polys)) if c is not None]
+    if not crops:
+        return ""
+    lines = [f.result() for f in _rec_batcher.submit_many(crops)]
+    return " ".join(text.strip() for text, score in lines if text and text.strip() and score >= MIN_REC_SCORE)
+
+
+def ocr_stats() -> dict:
+    return {"detection": _det_batcher.stats(), "recognition": _rec_batcher.stats()}
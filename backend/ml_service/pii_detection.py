@@ -1,20 +1,35 @@
-from gliner import GLiNER
-from transformers import pipeline, RobertaTokenizerFast, RobertaForSequenceClassification
-from paddleocr import PaddleOCR
-from PIL import Image, ImageEnhance
-from pdf2image import convert_from_bytes
+from PIL import Image
+from pdf2image import convert_from_path, pdfinfo_from_path
 import numpy as np
-import io
+import hashlib
+import json
 import os
 import re
 import magic
+import queue
+from array import array
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
 import tempfile
 import time
 
+from ml_service.batching import MicroBatcher
+from ml_service.config import env_bool, env_float, env_int, env_list, env_str
+from ml_service.ingest import MemoryViewFile
+from ml_service.model_registry import registry
+from ml_service.ocr_service import ocr_stats, recognize_image
+from ml_service.result_cache import LRUCache, NearDuplicateCache, ResultCache
+from ml_service.rule_engine import RULE_LABELS, align_entities, merge_entities, scan as scan_rules
+
 # ------------------------------
 # Helper: Text Chunking
 # ------------------------------
-def chunk_text(text, tokenizer, max_tokens=512, overlap=50):
+def chunk_token_ids(text, tokenizer, max_tokens=512, overlap=50):
+    """
+    Overlapping windows of at most `max_tokens` tokens (room left for the
+    special tokens), returned as token-ID lists so they can be fed to the
+    model directly without a decode/re-encode round trip.
+    """
     if not isinstance(text, str):
         text = str(text or "")
     text = text.strip()
@@ -25,71 +40,334 @@ def chunk_text(text, tokenizer, max_tokens=512, overlap=50):
         tokens = tokenizer.encode(text, add_special_tokens=False)
     except Exception as e:
         print(f"[Tokenizer error] {e}")
-        tokens = []
-
-    if not tokens:
-        return [text]
+        return []
 
-    chunks = []
+    windows = []
     start = 0
     while start < len(tokens):
         end = min(start + max_tokens - 2, len(tokens))
-        chunk = tokens[start:end]
-        if not chunk:
+        window = tokens[start:end]
+        if not window:
             break
+        windows.append(window)
+        start += max_tokens - overlap
+
+    return windows
+
+
+def tokenizer_fingerprint(tokenizer) -> str:
+    """
+    Hash of everything that decides how text maps to IDs (vocab, merges,
+    normalizer, special tokens). Classifiers with equal fingerprints can
+    share one tokenization of a document.
+    """
+    cached = getattr(tokenizer, "_aegis_fingerprint", None)
+    if cached:
+        return cached
+
+    try:
+        spec = tokenizer.backend_tokenizer.to_str()
+    except Exception:
+        spec = json.dumps(sorted(tokenizer.get_vocab().items()))
+    spec += json.dumps([type(tokenizer).__name__, tokenizer.all_special_ids], default=str)
+    fingerprint = hashlib.sha1(spec.encode("utf-8")).hexdigest()
+
+    try:
+        tokenizer._aegis_fingerprint = fingerprint
+    except Exception:
+        pass
+    return fingerprint
+
+
+def _aggregate_chunk_preds(chunk_preds, n_chunks, threshold=0.5):
+    aggregated = {}
+    for preds in chunk_preds:
+        for p in preds:
+            if p["score"] >= threshold:
+                aggregated[p["label"]] = aggregated.get(p["label"], 0) + p["score"]
+
+    for label in aggregated:
+        aggregated[label] /= max(n_chunks, 1)
+
+    return [{"label": label, "score": round(score, 3)} for label, score in aggregated.items()]
+
+
+# Chunks are sorted by length and run CHUNK_BATCH_SIZE at a time, so each
+# padded batch holds similarly sized windows and little compute goes to padding.
+CHUNK_BATCH_SIZE = env_int("AEGIS_CHUNK_BATCH_SIZE", 8)
+
+
+def _window_batches(tokenizer, windows, batch_size):
+    """Yield (indices, input_ids, attention_mask) over length-sorted, padded windows."""
+    import torch
+
+    pad_id = tokenizer.pad_token_id if tokenizer.pad_token_id is not None else 0
+    order = sorted(range(len(windows)), key=lambda i: len(windows[i]))
+    batch_size = max(int(batch_size), 1)
+
+    for start in range(0, len(order), batch_size):
+        bucket = order[start:start + batch_size]
+        sequences = [tokenizer.build_inputs_with_special_tokens(list(windows[i])) for i in bucket]
+        width = max(len(seq) for seq in sequences)
+        input_ids = torch.full((len(sequences), width), pad_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(sequences), width), dtype=torch.long)
+        for row, seq in enumerate(sequences):
+            input_ids[row, :len(seq)] = torch.tensor(seq, dtype=torch.long)
+            attention_mask[row, :len(seq)] = 1
+        yield bucket, input_ids, attention_mask
+
+
+def _top1(logits, id2label, problem_type=None):
+    """Pipeline-style post-processing: softmax (or sigmoid), then the best label."""
+    use_sigmoid = logits.shape[-1] == 1 or problem_type == "multi_label_classification"
+    probs = logits.sigmoid() if use_sigmoid else logits.softmax(dim=-1)
+    scores, label_ids = probs.max(dim=-1)
+    return [
+        [{"label": id2label.get(label_id, f"LABEL_{label_id}"), "score": score}]
+        for score, label_id in zip(scores.tolist(), label_ids.tolist())
+    ]
+
+
+def classify_windows(detector, windows, batch_size=CHUNK_BATCH_SIZE):
+    """
+    Run a classifier's model over token-ID windows in length-bucketed
+    batches, with text-classification pipeline post-processing
+    (softmax/sigmoid, top-1 label). Returns one prediction list per window
+    in the original order, or None for windows whose batch failed.
+    """
+    import torch
+
+    model = detector.model
+    preds = [None] * len(windows)
+    batches = _window_batches(detector.tokenizer, windows, batch_size)
+    for bucket, input_ids, attention_mask in batches:
         try:
-            chunk_text = tokenizer.decode(chunk, skip_special_tokens=True).strip()
+            with torch.inference_mode():
+                logits = model(
+                    input_ids=input_ids.to(model.device),
+                    attention_mask=attention_mask.to(model.device)
+                ).logits
+            for i, p in zip(bucket, _top1(logits, model.config.id2label, model.config.problem_type)):
+                preds[i] = p
         except Exception as e:
-            print(f"[Decode error] {e}")
-            chunk_text = ""
-        if chunk_text:
-            chunks.append(chunk_text)
-        start += max_tokens - overlap
+            print(f"[Windows {bucket} skipped: {e}]")
+
+    return preds
+
+
+def classify_windows_fused(fused, windows, batch_size=CHUNK_BATCH_SIZE):
+    """
+    Like classify_windows, but for a FusedClassifier: one encoder pass per
+    batch feeds every head. Returns {head: [preds or None per window]}.
+    """
+    import torch
+
+    model = fused.model
+    preds = {name: [None] * len(windows) for name in model.head_specs}
+    batches = _window_batches(fused.tokenizer, windows, batch_size)
+    for bucket, input_ids, attention_mask in batches:
+        try:
+            with torch.inference_mode():
+                logits_by_head = model(
+                    input_ids=input_ids.to(model.device),
+                    attention_mask=attention_mask.to(model.device)
+                )
+            for name, logits in logits_by_head.items():
+                spec = model.head_specs[name]
+                for i, p in zip(bucket, _top1(logits, spec["id2label"], spec.get("problem_type"))):
+                    preds[name][i] = p
+        except Exception as e:
+            print(f"[Windows {bucket} skipped: {e}]")
+
+    return preds
+
 
-    return chunks
+def _fused_per_window(fused, windows):
+    """classify_windows_fused reshaped to one {head: preds} dict (or None) per window."""
+    preds = classify_windows_fused(fused, list(windows))
+    return [
+        None if any(head_preds[i] is None for head_preds in preds.values())
+        else {name: head_preds[i] for name, head_preds in preds.items()}
+        for i in range(len(windows))
+    ]
 
 
 def analyze_long_text(text, detector, tokenizer, threshold=0.5):
-    chunks = chunk_text(text, tokenizer)
-    if not chunks:
+    windows = chunk_token_ids(text, tokenizer)
+    if not windows:
         return []
 
-    results = []
-    for i, chunk in enumerate(chunks):
+    chunk_preds = [p for p in classify_windows(detector, windows) if p is not None]
+    return _aggregate_chunk_preds(chunk_preds, len(windows), threshold)
+
+
+def analyze_long_text_multi(text, detectors: dict, threshold=0.5) -> dict:
+    """
+    Batched analyze_long_text for several classifiers at once.
+
+    `detectors` maps a name to a classifier. The document is tokenized once
+    per distinct tokenizer fingerprint and the resulting ID windows are
+    shared by every compatible model, each running length-bucketed batches.
+    Windows already scored (see the chunk cache) are not re-run.
+    Returns {name: aggregated results} with analyze_long_text semantics.
+    """
+    windows_by_fingerprint = {}
+    aggregated = {}
+    for name, detector in detectors.items():
+        fingerprint = tokenizer_fingerprint(detector.tokenizer)
+        if fingerprint not in windows_by_fingerprint:
+            windows_by_fingerprint[fingerprint] = chunk_token_ids(text, detector.tokenizer)
+        windows = windows_by_fingerprint[fingerprint]
+        if not windows:
+            aggregated[name] = []
+            continue
+        preds = _cached_window_preds(name, windows, lambda ws, d=detector: classify_windows(d, ws))
+        chunk_preds = [p for p in preds if p is not None]
+        aggregated[name] = _aggregate_chunk_preds(chunk_preds, len(windows), threshold)
+    return aggregated
+
+
+def analyze_long_text_fused(text, fused, threshold=0.5) -> dict:
+    """analyze_long_text_multi for a FusedClassifier: one encoder pass, every head."""
+    heads = list(fused.model.head_specs)
+    windows = chunk_token_ids(text, fused.tokenizer)
+    if not windows:
+        return {name: [] for name in heads}
+
+    preds = [p for p in _cached_window_preds("fused", windows, lambda ws: _fused_per_window(fused, ws)) if p]
+    return {
+        name: _aggregate_chunk_preds([p[name] for p in preds], len(windows), threshold)
+        for name in heads
+    }
+
+
+def _collect_chunk_preds(futures):
+    """Wait for per-window futures; failed windows come back as None."""
+    chunk_preds = []
+    for i, future in enumerate(futures):
         try:
-            preds = detector(chunk)
-            if isinstance(preds[0], list):
-                preds = preds[0]
-            for p in preds:
-                if p["score"] >= threshold:
-                    results.append(p)
+            chunk_preds.append(future.result())
         except Exception as e:
             print(f"[Chunk {i} skipped: {e}]")
-            continue
+            chunk_preds.append(None)
+    return chunk_preds
 
-    aggregated = {}
-    for r in results:
-        label = r["label"]
-        aggregated[label] = aggregated.get(label, 0) + r["score"]
 
-    for label in aggregated:
-        aggregated[label] /= max(len(chunks), 1)
+# ------------------------------
+# Chunk Cache (incremental re-analysis)
+# ------------------------------
+# Model outputs are memoized per window, keyed by model + window content.
+# When the extension re-sends a growing chat message, every window except
+# the edited tail is a cache hit, so only the changed windows hit the models.
+CHUNK_CACHE_ENABLED = env_bool("AEGIS_CHUNK_CACHE", True)
+GLINER_WINDOW_WORDS = env_int("AEGIS_GLINER_WINDOW_WORDS", 256)
+GLINER_OVERLAP_WORDS = env_int("AEGIS_GLINER_OVERLAP_WORDS", 32)
+
+chunk_cache = LRUCache(
+    max_entries=env_int("AEGIS_CHUNK_CACHE_SIZE", 8192),
+    max_bytes=env_int("AEGIS_CHUNK_CACHE_MAX_BYTES", 32 * 1024 * 1024),
+    ttl=env_int("AEGIS_CHUNK_CACHE_TTL", 900)
+)
+
+
+def _window_key(name, window, extra=""):
+    digest = hashlib.sha1(f"{name}|{model_version()}|{extra}|".encode("utf-8"))
+    if isinstance(window, str):
+        digest.update(window.encode("utf-8"))
+    else:
+        digest.update(array("q", window).tobytes())
+    return digest.hexdigest()
+
+
+def _lookup_windows(name, windows, extra=""):
+    """Returns (keys, preds, missing indices); preds holds cache hits or None."""
+    if not CHUNK_CACHE_ENABLED:
+        return None, [None] * len(windows), list(range(len(windows)))
+    keys = [_window_key(name, w, extra) for w in windows]
+    preds = [chunk_cache.get(k) for k in keys]
+    return keys, preds, [i for i, p in enumerate(preds) if p is None]
+
+
+def _store_windows(keys, preds, missing, computed):
+    for i, value in zip(missing, computed):
+        preds[i] = value
+        if keys is not None and value is not None:
+            chunk_cache.set(keys[i], value, size=len(json.dumps(value)))
+    return preds
+
+
+def _cached_window_preds(name, windows, compute, extra=""):
+    """Per-window memoization around `compute(windows) -> [preds or None]`."""
+    keys, preds, missing = _lookup_windows(name, windows, extra)
+    if missing:
+        _store_windows(keys, preds, missing, compute([windows[i] for i in missing]))
+    return preds
+
+
+def gliner_windows(text, max_words=None, overlap=None):
+    """
+    Split text into (char_offset, window_text) word windows for GLiNER.
+    Short texts come back as a single window.
+    """
+    max_words = max_words or GLINER_WINDOW_WORDS
+    overlap = GLINER_OVERLAP_WORDS if overlap is None else overlap
+    words = [m.span() for m in re.finditer(r"\S+", text)]
+    if len(words) <= max_words:
+        return [(0, text)] if words else []
+
+    windows = []
+    step = max(max_words - overlap, 1)
+    for start in range(0, len(words), step):
+        span = words[start:start + max_words]
+        windows.append((span[0][0], text[span[0][0]:span[-1][1]]))
+        if start + max_words >= len(words):
+            break
+    return windows
 
-    return [{"label": label, "score": round(score, 3)} for label, score in aggregated.items()]
+
+def _merge_window_entities(windows, entities_per_window):
+    """Shift window-relative entity offsets to the full text and drop overlap duplicates."""
+    merged = {}
+    for (offset, _), entities in zip(windows, entities_per_window):
+        for e in entities or []:
+            start, end = e.get("start", 0) + offset, e.get("end", 0) + offset
+            key = (start, end, e["label"])
+            if key not in merged or e.get("score", 0) > merged[key].get("score", 0):
+                merged[key] = {**e, "start": start, "end": end}
+    return sorted(merged.values(), key=lambda e: (e["start"], e["end"]))
+
+
+def predict_pii_entities(gliner_model, text, threshold=0.5):
+    """GLiNER over word windows, with per-window caching."""
+    windows = gliner_windows(text)
+    if not windows:
+        return []
+
+    def compute(window_texts):
+        return gliner_model.batch_predict_entities(window_texts, GLINER_LABELS, threshold=threshold)
+
+    entities = _cached_window_preds("gliner", [w for _, w in windows], compute, extra=threshold)
+    return _merge_window_entities(windows, entities)
+
+
+def chunk_cache_stats() -> dict:
+    return {"enabled": CHUNK_CACHE_ENABLED, **chunk_cache.stats()}
 
 
 # ------------------------------
-# Load Models with Error Handling
+# Model Loaders (lazy, via registry)
 # ------------------------------
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SELFHARM_MODEL_PATH = os.path.join(BASE_DIR, "models", "selfharm_model")
+DISEASE_MODEL_PATH = os.path.join(BASE_DIR, "models", "diseases_model")
+
+# torch | torch-int8 | onnx | onnx-int8 (see ml_service.inference_backend)
+CLASSIFIER_BACKEND = env_str("AEGIS_CLASSIFIER_BACKEND", "torch")
 
-# PII model
-print("Loading GLiNER PII model...")
-try:
-    gliner_model = GLiNER.from_pretrained("nvidia/gliner-pii")
-    print("GLiNER PII model loaded successfully.")
-except Exception as e:
-    print(f"Failed to load GLiNER PII model: {e}")
-    gliner_model = None
+# AEGIS_FUSED_CLASSIFIER=1 swaps the two RoBERTa classifiers for one shared
+# encoder with both heads (build it with ml_service.tools.build_fused_model).
+FUSED_CLASSIFIER = env_bool("AEGIS_FUSED_CLASSIFIER", False)
+FUSED_MODEL_PATH = env_str("AEGIS_FUSED_MODEL_PATH", os.path.join(BASE_DIR, "models", "fused_model"))
 
 LABELS = [
     "name", "date_of_birth", "age", "email", "phone_number",
@@ -101,68 +379,103 @@ LABELS = [
     "api_key", "access_token", "secret_key", "auth_token"
 ]
 
+# AEGIS_RULES: off (GLiNER only) | augment (rules + all GLiNER labels) |
+# replace (rules own RULE_LABELS, GLiNER is only asked for the rest).
+RULES_MODE = env_str("AEGIS_RULES", "off").lower()
+# Texts up to this many chars with no rule candidates skip GLiNER (the
+# self-harm / disease classifiers still run); 0 disables the shortcut.
+RULES_SHORT_TEXT_CHARS = env_int("AEGIS_RULES_SHORT_TEXT_CHARS", 0)
+GLINER_LABELS = [l for l in LABELS if l not in RULE_LABELS] if RULES_MODE == "replace" else LABELS
 
-# Self-Harm Model
-print("Loading Self-Harm Detection model...")
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-SELFHARM_MODEL_PATH = os.path.join(BASE_DIR, "models", "selfharm_model")
 
-try:
-    tokenizer_selfharm = RobertaTokenizerFast.from_pretrained(
-        SELFHARM_MODEL_PATH,
-        vocab_file=os.path.join(SELFHARM_MODEL_PATH, "vocab.json"),
-        merges_file=os.path.join(SELFHARM_MODEL_PATH, "merges.txt")
-    )
-    model_selfharm = RobertaForSequenceClassification.from_pretrained(SELFHARM_MODEL_PATH)
-    selfharm_detector = pipeline(
-        "text-classification",
-        model=model_selfharm,
-        tokenizer=tokenizer_selfharm
-    )
-    print("Self-Harm model loaded successfully.")
-except Exception as e:
-    print(f"Failed to load Self-Harm model: {e}")
-    selfharm_detector = None
-    tokenizer_selfharm = None
+def _load_gliner():
+    from gliner import GLiNER
+    return GLiNER.from_pretrained("nvidia/gliner-pii")
 
 
-# Disease Model
-print("Loading Disease Detection model...")
-DISEASE_MODEL_PATH = os.path.join(BASE_DIR, "models", "diseases_model")
+def _load_classifier(model_path, backend=None):
+    from ml_service.inference_backend import load_sequence_classifier
+    return load_sequence_classifier(model_path, backend or CLASSIFIER_BACKEND)
+
+
+def _load_fused():
+    from ml_service.fused_classifier import load_fused_classifier
+    return load_fused_classifier(FUSED_MODEL_PATH)
 
-try:
-    tokenizer = RobertaTokenizerFast.from_pretrained(
-        DISEASE_MODEL_PATH,
-        vocab_file=os.path.join(DISEASE_MODEL_PATH, "vocab.json"),
-        merges_file=os.path.join(DISEASE_MODEL_PATH, "merges.txt")
-    )
-    model = RobertaForSequenceClassification.from_pretrained(DISEASE_MODEL_PATH)
-    disease_detector = pipeline("text-classification", model=model, tokenizer=tokenizer)
-    print("Disease Detection model loaded successfully.")
-except Exception as e:
-    print(f"Failed to load Disease model: {e}")
-    disease_detector = None
-    tokenizer = None
 
+def _load_ocr():
+    from paddleocr import PaddleOCR
+    return PaddleOCR(use_textline_orientation=True, lang='en')
 
-# OCR Init
-print("Initializing PaddleOCR...")
-try:
-    ocr = PaddleOCR(use_textline_orientation=True, lang='en')
-    print("PaddleOCR initialized successfully.")
-except Exception as e:
-    print(f"PaddleOCR initialization failed: {e}")
-    ocr = None
+
+registry.register("gliner", _load_gliner)
+registry.register("selfharm", lambda: _load_classifier(SELFHARM_MODEL_PATH))
+registry.register("disease", lambda: _load_classifier(DISEASE_MODEL_PATH))
+registry.register("fused", _load_fused)
+registry.register("ocr", _load_ocr)
+
+# e.g. AEGIS_WARM_MODELS=gliner,selfharm,disease (or "all"); empty keeps startup cheap.
+registry.warm(env_list("AEGIS_WARM_MODELS"))
 
 
 # ------------------------------
 # Helper Functions
 # ------------------------------
-def preprocess_image(image: Image.Image) -> Image.Image:
-    img = image.convert("RGB")
-    img = ImageEnhance.Contrast(img).enhance(1.3)
-    img = ImageEnhance.Brightness(img).enhance(1.1)
-    return img
+# OCR cost should follow the amount of text, not the upload's pixel count:
+# images whose text is taller than AEGIS_OCR_TEXT_HEIGHT px are scaled down
+# (never up) before OCR, e.g. 2x/3x retina screenshots.
+OCR_TEXT_HEIGHT = env_int("AEGIS_OCR_TEXT_HEIGHT", 32)
+OCR_MIN_SCALE = env_float("AEGIS_OCR_MIN_SCALE", 0.35)
+OCR_MAX_SIDE = env_int("AEGIS_OCR_MAX_SIDE", 4096)
+CONTRAST, BRIGHTNESS = 1.3, 1.1
+
+
+def _enhance_lut(mean: float) -> np.ndarray:
+    """ImageEnhance.Contrast(1.3) then Brightness(1.1), fused into one 256-entry table."""
+    v = np.arange(256, dtype=np.float32)
+    v = np.clip(mean + CONTRAST * (v - mean), 0, 255)
+    v = np.clip(v * BRIGHTNESS, 0, 255)
+    return (v + 0.5).astype(np.uint8)
+
+
+def estimate_text_height(gray: np.ndarray):
+    """
+    Median height (px) of ink row-runs in 8 vertical strips of a grayscale
+    image, a cheap proxy for the text line height. None if too few lines.
+    """
+    background = float(np.median(gray[::4, ::4]))
+    ink = gray > background + 40 if background < 128 else gray < background - 40  # dark or light theme
+    runs = []
+    for strip in np.array_split(ink, 8, axis=1):
+        rows = np.concatenate(([0], (strip.mean(axis=1) > 0.01).view(np.int8), [0]))
+        edges = np.flatnonzero(np.diff(rows))
+        lengths = edges[1::2] - edges[::2]
+        runs.extend(lengths[lengths >= 3].tolist())
+    return float(np.median(runs)) if len(runs) >= 3 else None
+
+
+def preprocess_image(image: Image.Image) -> np.ndarray:
+    """
+    RGB uint8 array ready for OCR: adaptively downscaled, then contrast and
+    brightness applied in place through one LUT. One full-size copy total.
+    """
+    img = image if image.mode == "RGB" else image.convert("RGB")
+
+    # Statistics come from a half-size grayscale copy.
+    gray = np.asarray(img.reduce(2).convert("L"))
+    text_height = estimate_text_height(gray)
+    scale = min(1.0, OCR_MAX_SIDE / max(img.size))
+    if text_height:
+        scale = min(scale, max(OCR_TEXT_HEIGHT / (text_height * 2), OCR_MIN_SCALE))
+    if scale < 0.9:
+        size = (max(int(img.width * scale), 1), max(int(img.height * scale), 1))
+        img = img.resize(size, Image.BILINEAR, reducing_gap=2.0)
+
+    import cv2  # ships with paddleocr
+
+    arr = np.array(img)
+    cv2.LUT(arr, _enhance_lut(float(gray.mean())), dst=arr)  # in place; np.take would copy to intp indices
+    return arr
 
 
 def clean_ocr_text(text: str) -> str:
@@ -172,12 +485,58 @@ def clean_ocr_text(text: str) -> str:
     return text
 
 
-def extract_text_from_image(image: Image.Image) -> str:
-    if ocr is None:
-        print("OCR not available, skipping image extraction.")
-        return ""
+# PaddleOCR instances are not safe to share between threads, so OCR goes
+# through a pool of AEGIS_OCR_ENGINES engines: slot 0 is the registry's
+# "ocr" model, further slots load their own instance on first use.
+OCR_ENGINES = max(env_int("AEGIS_OCR_ENGINES", 1), 1)
+_ocr_slots = queue.Queue()
+for _slot in range(OCR_ENGINES):
+    _ocr_slots.put(_slot)
+_extra_ocr = {}
+
+
+@contextmanager
+def ocr_engine():
+    slot = _ocr_slots.get()
+    try:
+        if slot == 0:
+            yield registry.get("ocr")
+            return
+        if slot not in _extra_ocr:
+            try:
+                _extra_ocr[slot] = _load_ocr()
+            except Exception as e:
+                print(f"OCR engine {slot} failed to load: {e}")
+                _extra_ocr[slot] = None
+        yield _extra_ocr[slot]
+    finally:
+        _ocr_slots.put(slot)
+
+
+# AEGIS_OCR_BATCHED=1 routes OCR through ocr_service: per-image detection,
+# then recognition of line crops from all concurrent images in one batch.
+OCR_BATCHED = env_bool("AEGIS_OCR_BATCHED", False)
+
+
+def extract_text_from_image(image) -> str:
+    """OCR a PIL image or (zero-copy) an RGB uint8 array from preprocess_image."""
+    if OCR_BATCHED:
+        try:
+            return recognize_image(image if isinstance(image, np.ndarray) else np.array(image))
+        except Exception as e:
+            print(f"OCR extraction error: {e}")
+            return ""
+
+    with ocr_engine() as ocr:
+        if ocr is None:
+            print("OCR not available, skipping image extraction.")
+            return ""
+        return _run_ocr(ocr, image)
+
+
+def _run_ocr(ocr, image) -> str:
     try:
-        result = ocr.ocr(np.array(image))
+        result = ocr.ocr(image if isinstance(image, np.ndarray) else np.array(image))
         texts = []
         if isinstance(result, list):
             for entry in result:
@@ -213,69 +572,436 @@ SENSITIVITY_SCORES = {
 # ------------------------------
 # Text Analysis
 # ------------------------------
-def analyze_text(text: str, threshold: float = 0.5) -> dict:
+def _pii_results(entities):
+    return [
+        {"label": e["label"], "sensitivity_score": SENSITIVITY_SCORES.get(e["label"], 0.7)}
+        for e in entities
+    ]
+
+
+def _selfharm_results(aggregated):
     results = []
+    for sr in aggregated:
+        if sr["label"] in ["LABEL_1", "1", "self_harm", "emotional_distress"]:
+            results.append({"label": "self_harm_risk", "sensitivity_score": 1.0})
+    return results
+
+
+def _disease_results(aggregated):
+    results = []
+    for dr in aggregated:
+        if dr["label"] == "LABEL_1":
+            results.append({
+                "label": "detected_disease",
+                "sensitivity_score": SENSITIVITY_SCORES.get("detected_disease", 0.6)
+            })
+    return results
+
+
+def _rule_entities(text: str, raw_text: str = None) -> list:
+    # clean_ocr_text strips "_ + = %" and friends, which keys and email local
+    # parts need, so rules scan the raw input and are re-anchored afterwards.
+    if RULES_MODE == "off":
+        return []
+    if raw_text is None:
+        return scan_rules(text)
+    return align_entities(scan_rules(raw_text), text, clean_ocr_text)
+
+
+def analyze_text(text: str, threshold: float = 0.5, raw_text: str = None) -> dict:
+    # Deterministic formats (emails, cards, keys, ...) are found by the rule
+    # engine first; short texts with no candidates can skip GLiNER. The
+    # rules say nothing about self-harm or disease, so the classifiers
+    # always run.
+    rule_entities = _rule_entities(text, raw_text)
+    use_gliner = not (RULES_MODE != "off" and not rule_entities and len(text) <= RULES_SHORT_TEXT_CHARS)
+
+    if BATCHING_ENABLED:
+        return _analyze_text_batched(text, threshold, rule_entities, use_gliner)
+
+    results = []
+    gliner_model = registry.get("gliner") if use_gliner else None
 
     # PII Detection
+    pii_entities = []
     if gliner_model:
         try:
-            pii_entities = gliner_model.predict_entities(text, LABELS, threshold=threshold)
-            for e in pii_entities:
-                results.append({
-                    "label": e["label"],
-                    "sensitivity_score": SENSITIVITY_SCORES.get(e["label"], 0.7)
-                })
+            pii_entities = predict_pii_entities(gliner_model, text, threshold)
         except Exception as e:
             print(f"PII analysis failed: {e}")
+    results.extend(_pii_results(merge_entities(rule_entities, pii_entities)))
+
+    # Self-Harm + Disease Detection (chunked, batched)
+    try:
+        aggregated = _analyze_classifiers(text)
+    except Exception as e:
+        print(f"Classifier analysis failed: {e}")
+        aggregated = {}
+    results.extend(_selfharm_results(aggregated.get("selfharm", [])))
+    results.extend(_disease_results(aggregated.get("disease", [])))
+
+    return results
+
+
+def _analyze_classifiers(text):
+    if FUSED_CLASSIFIER:
+        fused = registry.get("fused")
+        return analyze_long_text_fused(text, fused) if fused else {}
+
+    detectors = {}
+    for name in ("selfharm", "disease"):
+        detector = registry.get(name)
+        if detector:
+            detectors[name] = detector
+    return analyze_long_text_multi(text, detectors)
+
+
+# ------------------------------
+# Micro-Batched Text Analysis
+# ------------------------------
+# With AEGIS_BATCHING=1, concurrent analyze_text calls share forward passes:
+# every request enqueues its text (GLiNER) and chunks (classifiers), and one
+# background thread per model runs whatever has accumulated as a padded batch.
+BATCHING_ENABLED = env_bool("AEGIS_BATCHING", False)
+BATCH_MAX_SIZE = env_int("AEGIS_BATCH_MAX_SIZE", 16)
+BATCH_MAX_WAIT_MS = env_float("AEGIS_BATCH_MAX_WAIT_MS", 5.0)
+
+
+def _gliner_batch(items):
+    gliner_model = registry.get("gliner")
+    if gliner_model is None:
+        raise RuntimeError("GLiNER model unavailable")
+
+    # Items carry their own threshold; group so each group is one forward pass.
+    by_threshold = {}
+    for i, (text, threshold) in enumerate(items):
+        by_threshold.setdefault(threshold, []).append(i)
+
+    outputs = [None] * len(items)
+    for threshold, indices in by_threshold.items():
+        texts = [items[i][0] for i in indices]
+        entities = gliner_model.batch_predict_entities(texts, GLINER_LABELS, threshold=threshold)
+        for i, ents in zip(indices, entities):
+            outputs[i] = ents
+    return outputs
+
+
+def _classifier_batch(name):
+    def run(windows):
+        detector = registry.get(name)
+        if detector is None:
+            raise RuntimeError(f"{name} model unavailable")
+        return classify_windows(detector, list(windows))
+    return run
+
+
+def _fused_batch(windows):
+    fused = registry.get("fused")
+    if fused is None:
+        raise RuntimeError("fused model unavailable")
+    return _fused_per_window(fused, windows)
+
+
+_batchers = {
+    "gliner": MicroBatcher("gliner", _gliner_batch, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS),
+    "fused": MicroBatcher("fused", _fused_batch, BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS),
+    "selfharm": MicroBatcher("selfharm", _classifier_batch("selfharm"), BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS),
+    "disease": MicroBatcher("disease", _classifier_batch("disease"), BATCH_MAX_SIZE, BATCH_MAX_WAIT_MS),
+}
+
+
+def batching_stats() -> dict:
+    return {
+        "enabled": BATCHING_ENABLED,
+        "models": {name: b.stats() for name, b in _batchers.items()},
+        "ocr": {"enabled": OCR_BATCHED, **ocr_stats()},
+    }
+
+
+def _submit_windows(name, batcher, windows, extra=""):
+    """Cache lookup, then enqueue only the missing windows on `batcher`."""
+    keys, preds, missing = _lookup_windows(name, windows, extra)
+    futures = batcher.submit_many([windows[i] for i in missing]) if missing else []
+    return keys, preds, missing, futures
+
+
+def _resolve_windows(pending):
+    keys, preds, missing, futures = pending
+    return _store_windows(keys, preds, missing, _collect_chunk_preds(futures))
+
+
+def _analyze_text_batched(text: str, threshold: float = 0.5, rule_entities=(), use_gliner=True) -> dict:
+    results = []
+
+    # Enqueue everything first so all three models batch in parallel.
+    gliner_pending = None
+    if use_gliner and registry.get("gliner"):
+        g_windows = gliner_windows(text)
+        items = [(w, threshold) for _, w in g_windows]
+        keys, preds, missing = _lookup_windows("gliner", [w for _, w in g_windows], threshold)
+        futures = _batchers["gliner"].submit_many([items[i] for i in missing]) if missing else []
+        gliner_pending = (g_windows, (keys, preds, missing, futures))
+
+    chunk_pending = {}
+    if FUSED_CLASSIFIER:
+        fused = registry.get("fused")
+        if fused:
+            windows = chunk_token_ids(text, fused.tokenizer)
+            chunk_pending["fused"] = (len(windows), _submit_windows("fused", _batchers["fused"], windows))
+    else:
+        windows_by_fingerprint = {}
+        for name in ("selfharm", "disease"):
+            detector = registry.get(name)
+            if detector:
+                fingerprint = tokenizer_fingerprint(detector.tokenizer)
+                if fingerprint not in windows_by_fingerprint:
+                    windows_by_fingerprint[fingerprint] = chunk_token_ids(text, detector.tokenizer)
+                windows = windows_by_fingerprint[fingerprint]
+                chunk_pending[name] = (len(windows), _submit_windows(name, _batchers[name], windows))
 
-    # Self-Harm Detection
-    if selfharm_detector and tokenizer_selfharm:
+    pii_entities = []
+    if gliner_pending is not None:
         try:
-            selfharm_results = analyze_long_text(text, selfharm_detector, tokenizer_selfharm)
-            for sr in selfharm_results:
-                if sr["label"] in ["LABEL_1", "1", "self_harm", "emotional_distress"]:
-                    results.append({"label": "self_harm_risk", "sensitivity_score": 1.0})
+            g_windows, pending = gliner_pending
+            pii_entities = _merge_window_entities(g_windows, _resolve_windows(pending))
         except Exception as e:
-            print(f"Self-harm analysis failed: {e}")
+            print(f"PII analysis failed: {e}")
+    results.extend(_pii_results(merge_entities(list(rule_entities), pii_entities)))
+
+    aggregated = {}
+    for name, (n_chunks, pending) in chunk_pending.items():
+        if not n_chunks:
+            continue
+        chunk_preds = [p for p in _resolve_windows(pending) if p is not None]
+        if name == "fused":
+            for head in ("selfharm", "disease"):
+                head_preds = [p[head] for p in chunk_preds if head in p]
+                aggregated[head] = _aggregate_chunk_preds(head_preds, n_chunks)
+        else:
+            aggregated[name] = _aggregate_chunk_preds(chunk_preds, n_chunks)
+
+    results.extend(_selfharm_results(aggregated.get("selfharm", [])))
+    results.extend(_disease_results(aggregated.get("disease", [])))
+    return results
+
+
+# ------------------------------
+# Document Pipeline (PDF)
+# ------------------------------
+# Pages are rendered one at a time by poppler straight to PPM (no JPEG
+# encode/decode), preprocessed and OCR'd on a worker pool, and each page is
+# analyzed as soon as its text is ready, so rasterization, OCR and analysis
+# of different pages overlap. The OCR step itself only runs in parallel with
+# AEGIS_OCR_ENGINES > 1 or AEGIS_OCR_BATCHED=1; with one engine, pages still
+# rasterize concurrently but queue for OCR.
+PDF_MAX_PAGES = env_int("AEGIS_PDF_MAX_PAGES", 2)  # 0 = every page
+PDF_DPI = env_int("AEGIS_PDF_DPI", 150)
+OCR_WORKERS = max(env_int("AEGIS_OCR_WORKERS", 4), 1)
+
+_page_pool = ThreadPoolExecutor(max_workers=OCR_WORKERS, thread_name_prefix="aegis-ocr")
+
+# Document-level labels: reported once even if several pages trigger them.
+_DOCUMENT_LABELS = ("self_harm_risk", "detected_disease")
+
 
-    # Disease Detection
-    if disease_detector and tokenizer:
+def pdf_page_count(path, max_pages) -> int:
+    pages = int(pdfinfo_from_path(path).get("Pages", 1))
+    return min(pages, max_pages) if max_pages else pages
+
+
+def _ocr_pdf_page(path, page) -> str:
+    images = convert_from_path(path, dpi=PDF_DPI, first_page=page, last_page=page, fmt="ppm")
+    return extract_text_from_image(preprocess_image(images[0])) if images else ""
+
+
+def analyze_pdf(data, threshold: float = 0.5, max_pages: int = PDF_MAX_PAGES):
+    # poppler reads from a path: write the upload once and render every page
+    # from that file (convert_from_bytes would write a new copy per page).
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+        f.write(data)
+    try:
+        return _analyze_pdf_file(f.name, threshold, max_pages)
+    finally:
+        os.unlink(f.name)
+
+
+def _analyze_pdf_file(path, threshold, max_pages):
+    n_pages = pdf_page_count(path, max_pages)
+    futures = {_page_pool.submit(_ocr_pdf_page, path, page): page for page in range(1, n_pages + 1)}
+
+    page_results = {}
+    for future in as_completed(futures):
+        page = futures[future]
         try:
-            disease_results = analyze_long_text(text, disease_detector, tokenizer)
-            for dr in disease_results:
-                if dr["label"] == "LABEL_1":
-                    results.append({
-                        "label": "detected_disease",
-                        "sensitivity_score": SENSITIVITY_SCORES.get("detected_disease", 0.6)
-                    })
+            raw_text = future.result()
         except Exception as e:
-            print(f"Disease analysis failed: {e}")
+            print(f"OCR failed for page {page}: {e}")
+            continue
+        text = clean_ocr_text(raw_text)
+        if text:
+            page_results[page] = analyze_text(text, threshold, raw_text=raw_text)
 
-    return results
+    if not page_results:
+        return {"error": "No text detected in file."}
+
+    merged, seen = [], set()
+    for page in sorted(page_results):
+        for item in page_results[page]:
+            if item["label"] in _DOCUMENT_LABELS:
+                if item["label"] in seen:
+                    continue
+                seen.add(item["label"])
+            merged.append(item)
+    return merged
+
+
+# ------------------------------
+# Result Cache
+# ------------------------------
+# The extension re-sends the same text on every debounced edit and often the
+# same screenshot, so finished results are cached by content hash.
+RESULT_CACHE_ENABLED = env_bool("AEGIS_RESULT_CACHE", True)
+
+result_cache = ResultCache(
+    LRUCache(
+        max_entries=env_int("AEGIS_RESULT_CACHE_SIZE", 1024),
+        max_bytes=env_int("AEGIS_RESULT_CACHE_MAX_BYTES", 16 * 1024 * 1024),
+        ttl=env_int("AEGIS_RESULT_CACHE_TTL", 300)
+    ),
+    redis_ttl=env_int("AEGIS_RESULT_CACHE_REDIS_TTL", 3600)
+)
+if RESULT_CACHE_ENABLED and env_bool("AEGIS_RESULT_CACHE_REDIS", False):
+    from ml_service.redis_client import redis_client
+    result_cache.redis = redis_client
+
+_model_version = None
+
+
+def model_version() -> str:
+    """Fingerprint of everything model-side that shapes detect_pii output."""
+    global _model_version
+    if _model_version is None:
+        digest = hashlib.sha1()
+        for path in (SELFHARM_MODEL_PATH, DISEASE_MODEL_PATH, FUSED_MODEL_PATH):
+            config_path = os.path.join(path, "config.json")
+            if os.path.exists(config_path):
+                with open(config_path, "rb") as f:
+                    digest.update(f.read())
+        digest.update(json.dumps([
+            "nvidia/gliner-pii", GLINER_LABELS, SENSITIVITY_SCORES, CLASSIFIER_BACKEND, FUSED_CLASSIFIER, RULES_MODE,
+            OCR_BATCHED, OCR_TEXT_HEIGHT, OCR_MIN_SCALE, OCR_MAX_SIDE
+        ], sort_keys=True).encode("utf-8"))
+        _model_version = digest.hexdigest()[:16]
+    return _model_version
+
+
+def _result_cache_key(input_data, threshold, max_pages):
+    if not RESULT_CACHE_ENABLED:
+        return None
+    if isinstance(input_data, str):
+        input_type, payload = "text", input_data.encode("utf-8")
+    elif isinstance(input_data, (bytes, bytearray, memoryview)):
+        input_type, payload = "file", input_data
+    else:
+        return None
+    return ResultCache.make_key(
+        input_type, payload, threshold=threshold, max_pages=max_pages, models=model_version()
+    )
+
+
+def result_cache_stats() -> dict:
+    return {
+        "enabled": RESULT_CACHE_ENABLED,
+        "model_version": model_version(),
+        **result_cache.stats(),
+        "ocr": {"enabled": OCR_CACHE_ENABLED, **ocr_cache.stats()},
+    }
+
+
+# ------------------------------
+# OCR Cache (near-duplicate screenshots)
+# ------------------------------
+# The extension resends identical screenshots and re-encoded copies of the
+# same file; their bytes differ, so the result cache misses, but their
+# perceptual hash does not. Extracted text is reused within
+# AEGIS_OCR_CACHE_DISTANCE differing bits of a 256-bit dHash. Keep the
+# distance small: a coarse hash cannot see a few edited words.
+OCR_CACHE_ENABLED = env_bool("AEGIS_OCR_CACHE", True)
+DHASH_SIZE = 16
+
+_ocr_cache_redis = None
+if OCR_CACHE_ENABLED and env_bool("AEGIS_OCR_CACHE_REDIS", False):
+    from ml_service.redis_client import redis_client as _ocr_cache_redis
+
+ocr_cache = NearDuplicateCache(
+    LRUCache(
+        max_entries=env_int("AEGIS_OCR_CACHE_SIZE", 1024),
+        max_bytes=env_int("AEGIS_OCR_CACHE_MAX_BYTES", 8 * 1024 * 1024),
+        ttl=env_int("AEGIS_OCR_CACHE_TTL", 3600)
+    ),
+    max_distance=env_int("AEGIS_OCR_CACHE_DISTANCE", 3),
+    redis_client=_ocr_cache_redis,
+    redis_ttl=env_int("AEGIS_OCR_CACHE_REDIS_TTL", 86400),
+    prefix=f"aegis:cache:ocr:{model_version()}:"
+)
+
+
+def dhash(image: Image.Image, size: int = DHASH_SIZE) -> int:
+    """Difference hash: sign of horizontal gradients on a (size+1) x size grayscale thumbnail."""
+    if image.mode not in ("RGB", "RGBA", "L"):
+        image = image.convert("RGB")
+    small = np.asarray(image.resize((size + 1, size), Image.BILINEAR, reducing_gap=2.0).convert("L"), dtype=np.int16)
+    bits = (small[:, 1:] > small[:, :-1]).ravel()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def extract_text_cached(image: Image.Image) -> str:
+    """preprocess_image + extract_text_from_image, skipped for near-duplicates of earlier images."""
+    if not OCR_CACHE_ENABLED:
+        return extract_text_from_image(preprocess_image(image))
+
+    image_hash = dhash(image)
+    text = ocr_cache.get(image_hash)
+    if text is None:
+        text = extract_text_from_image(preprocess_image(image))
+        if text:
+            ocr_cache.set(image_hash, text)
+    return text
 
 
 # ------------------------------
 # Main Function
 # ------------------------------
-def detect_pii(input_data, threshold: float = 0.5, max_pages: int = 2):
+def detect_pii(input_data, threshold: float = 0.5, max_pages: int = None):
+    max_pages = PDF_MAX_PAGES if max_pages is None else max_pages
+    key = _result_cache_key(input_data, threshold, max_pages)
+    if key:
+        cached = result_cache.get(key)
+        if cached is not None:
+            return cached
+
+    result = _detect_pii(input_data, threshold, max_pages)
+    if key and isinstance(result, list):
+        result_cache.set(key, result)
+    return result
+
+
+def _detect_pii(input_data, threshold: float = 0.5, max_pages: int = PDF_MAX_PAGES):
     try:
         if isinstance(input_data, str):
             cleaned_text = clean_ocr_text(input_data)
-            return analyze_text(cleaned_text, threshold)
+            return analyze_text(cleaned_text, threshold, raw_text=input_data)
 
-        elif isinstance(input_data, (bytes, bytearray)):
-            file_type = (magic.from_buffer(input_data[:2048], mime=True) or "").lower()
+        elif isinstance(input_data, (bytes, bytearray, memoryview)):
+            file_type = (magic.from_buffer(bytes(input_data[:2048]), mime=True) or "").lower()
             extracted_text = ""
 
             if "image" in file_type:
-                img = Image.open(io.BytesIO(input_data))
-                img = preprocess_image(img)
-                extracted_text = extract_text_from_image(img)
+                img = Image.open(MemoryViewFile(input_data))  # no copy of the upload
+                extracted_text = extract_text_cached(img)
 
             elif "pdf" in file_type:
-                pages = convert_from_bytes(input_data, dpi=150, first_page=1, last_page=max_pages, fmt="jpeg")
-                page_texts = [extract_text_from_image(preprocess_image(p)) for p in pages]
-                extracted_text = " ".join(page_texts)
+                return analyze_pdf(input_data, threshold, max_pages)
             else:
                 return {"error": f"Unsupported file type: {file_type or 'unknown'}"}
 
@@ -283,10 +1009,10 @@ def detect_pii(input_data, threshold: float = 0.5, max_pages: int = 2):
                 return {"error": "No text detected in file."}
 
             cleaned_text = clean_ocr_text(extracted_text)
-            return analyze_text(cleaned_text, threshold)
+            return analyze_text(cleaned_text, threshold, raw_text=extracted_text)
 
         else:
-            return {"error": "Unsupported input type. Must be string or bytes."}
+            return {"error": "Unsupported input type. Must be string, bytes or memoryview."}
     except Exception as e:
         return {"error": str(e)}
 
@@ -1,23 +1,375 @@
+import os
 import redis
 import json
+import socket
+import threading
+import time
 import uuid
+import weakref
+
+from ml_service.config import env_bool, env_int
+
+# ------------------------------
+# Pooled client factory
+# ------------------------------
+# Every backend module (views, workers, consumer, Pathway connectors) gets
+# its client here, so they share one connection pool per process and all
+# honour settings.REDIS_* (or the REDIS_* env vars outside Django).
+#
+# Pools are BlockingConnectionPools: when all connections are checked out a
+# caller waits up to REDIS_POOL_TIMEOUT seconds instead of failing with
+# "Too many connections". Long-poll and SSE waits hold a connection for the
+# whole BLPOP, so they draw from a separate pool (blocking=True) capped at
+# REDIS_BLOCKING_MAX_CONNECTIONS and cannot starve ordinary commands.
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def redis_settings() -> dict:
+    try:
+        from django.conf import settings
+        if settings.configured:
+            return {
+                "host": getattr(settings, "REDIS_HOST", "localhost"),
+                "port": int(getattr(settings, "REDIS_PORT", 6379)),
+                "db": int(getattr(settings, "REDIS_DB", 0)),
+                "max_connections": int(getattr(settings, "REDIS_MAX_CONNECTIONS", 64)),
+                "blocking_max_connections": int(getattr(settings, "REDIS_BLOCKING_MAX_CONNECTIONS", 256)),
+                "pool_timeout": float(getattr(settings, "REDIS_POOL_TIMEOUT", 5)),
+            }
+    except ImportError:
+        pass
+    return {
+        "host": os.environ.get("REDIS_HOST", "localhost"),
+        "port": int(os.environ.get("REDIS_PORT", 6379)),
+        "db": int(os.environ.get("REDIS_DB", 0)),
+        "max_connections": int(os.environ.get("REDIS_MAX_CONNECTIONS", 64)),
+        "blocking_max_connections": int(os.environ.get("REDIS_BLOCKING_MAX_CONNECTIONS", 256)),
+        "pool_timeout": float(os.environ.get("REDIS_POOL_TIMEOUT", 5)),
+    }
+
+
+def get_redis(decode_responses=True, host=None, port=None, db=None, blocking=False) -> redis.Redis:
+    """
+    Client backed by a shared, lazily created connection pool. Pass
+    blocking=True for clients that issue long BLPOP waits.
+    """
+    conf = redis_settings()
+    key = (host or conf["host"], port or conf["port"], conf["db"] if db is None else db, decode_responses, blocking)
+    pool = _pools.get(key)
+    if pool is None:
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = redis.BlockingConnectionPool(
+                    host=key[0], port=key[1], db=key[2],
+                    decode_responses=decode_responses,
+                    max_connections=conf["blocking_max_connections" if blocking else "max_connections"],
+                    timeout=conf["pool_timeout"]
+                )
+                _pools[key] = pool
+    return redis.Redis(connection_pool=pool)
+
+
+# redis.asyncio connections belong to the event loop that opened them, so
+# clients are cached per running loop (and dropped with it).
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_redis(blocking=False):
+    """
+    redis.asyncio client (decoded responses) shared within the running event
+    loop; call from async code only. See get_redis for `blocking`.
+    """
+    import asyncio
+
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    client = clients.get(blocking)
+    if client is None:
+        import redis.asyncio as aioredis
+
+        conf = redis_settings()
+        pool = aioredis.BlockingConnectionPool(
+            host=conf["host"], port=conf["port"], db=conf["db"], decode_responses=True,
+            max_connections=conf["blocking_max_connections" if blocking else "max_connections"],
+            timeout=conf["pool_timeout"]
+        )
+        client = clients[blocking] = aioredis.Redis(connection_pool=pool)
+    return client
+
+
+redis_client = get_redis(decode_responses=False)
+
+RESULT_QUEUE_KEY = "aegis:results"
+SCORE_STREAM_KEY = "scores_stream"
+GLOBAL_STATS_KEY = "stats:global"  # hash written by pathway_engine.pipeline
+LABEL_STATS_KEY = "stats:by_label"  # hash: label -> JSON stats row
+SKETCH_KEY = "stats:sketches"  # hash: serialized KLL / HyperLogLog sketches (pathway_engine.sketches)
+LABEL_SKETCH_KEY = "stats:sketches:by_label"  # hash: label -> JSON of that label's sketches
+BUCKET_KEY = "stats:bucket:{seconds}:{start}"  # hash: label (or "_global") -> JSON bucket row
+BUCKET_GLOBAL_FIELD = "_global"
+# bucket size (seconds) -> retention (seconds) of the time-bucket series
+BUCKET_RETENTION = {10: 15 * 60, 60: 2 * 3600, 3600: 7 * 24 * 3600}
+JOB_QUEUE_KEY = "aegis:jobs"
+JOB_INPUT_KEY = "aegis:job:{session_id}:input"
+JOB_INPUT_TTL = 600
+
+# With AEGIS_USE_STREAMS=1 results and scores go to Redis Streams instead
+# of the two lists above, read through consumer groups (see StreamConsumer).
+USE_STREAMS = env_bool("AEGIS_USE_STREAMS", False)
+RESULT_XSTREAM_KEY = "aegis:results:stream"
+SCORE_XSTREAM_KEY = "aegis:scores:stream"
+RESULT_GROUP = "aegis-consumers"
+SCORE_GROUP = "aegis-pathway"
+STREAM_FIELD = "data"
+STREAM_MAXLEN = env_int("AEGIS_STREAM_MAXLEN", 100000)
+
+
+def queue_result(pipe, session_id, result_data):
+    """Add the consumer.py hand-off for one session to `pipe` (sync or async pipeline)."""
+    payload = json.dumps({"session_id": session_id, "result_data": result_data})
+    if USE_STREAMS:
+        pipe.xadd(RESULT_XSTREAM_KEY, {STREAM_FIELD: payload}, maxlen=STREAM_MAXLEN, approximate=True)
+    else:
+        pipe.lpush(RESULT_QUEUE_KEY, payload)
+
+
+def _score_of(item):
+    """
+    Pathway score (0-100, as the pipeline's brackets expect) of one item:
+    `score` as given (e.g. /api/score/), else detect_pii's 0-1
+    `sensitivity_score` scaled up. None for items that carry neither.
+    """
+    if not isinstance(item, dict) or "label" not in item:
+        return None
+    if "score" in item:
+        return item["score"]
+    if "sensitivity_score" in item:
+        return round(float(item["sensitivity_score"]) * 100, 2)
+    return None
+
+
+def queue_scores(pipe, items, session_id=None) -> int:
+    """Add one Pathway score row per scored item to `pipe`; returns the count."""
+    scores = []
+    if isinstance(items, list):
+        now = time.time()  # event time for the Pathway windows
+        extra = {"session_id": session_id} if session_id else {}
+        for item in items:
+            score = _score_of(item)
+            if score is not None:
+                scores.append(json.dumps({**item, "score": score, "ts": item.get("ts", now), **extra}))
+    if not scores:
+        return 0
+    if USE_STREAMS:
+        for payload in scores:
+            pipe.xadd(SCORE_XSTREAM_KEY, {STREAM_FIELD: payload}, maxlen=STREAM_MAXLEN, approximate=True)
+    else:
+        pipe.rpush(SCORE_STREAM_KEY, *scores)
+    return len(scores)
 
-redis_client = redis.StrictRedis(host="localhost", port=6379, db=0)
 
 def push_to_queue(result_data, session_id=None):
     if not session_id:
         session_id = str(uuid.uuid4())
 
-    payload = {
-        "session_id": session_id,
-        "result_data": result_data
-    }
-
-    redis_client.lpush("aegis:results", json.dumps(payload))
+    pipe = redis_client.pipeline(transaction=False)
+    queue_result(pipe, session_id, result_data)
+    pipe.execute()
     return session_id
 
 
+def publish_result(result_data, session_id=None):
+    """
+    push_to_queue plus the per-detection Pathway stream pushes, pipelined
+    into a single round trip. Returns (session_id, pathway_push_count).
+    """
+    if not session_id:
+        session_id = str(uuid.uuid4())
+
+    pipe = redis_client.pipeline(transaction=False)
+    queue_result(pipe, session_id, result_data)
+    count = queue_scores(pipe, result_data, session_id)
+    pipe.execute()
+    return session_id, count
+
+
 def fetch_processed_result(session_id):
-    key = f"aegis:processed:{session_id}"
-    data = redis_client.get(key)
+    data = redis_client.get(PROCESSED_KEY.format(session_id=session_id))
     return json.loads(data) if data else None
+
+
+# ------------------------------
+# Raw-input job queue (async analyze)
+# ------------------------------
+def push_job(kind, payload, session_id=None):
+    """
+    Store raw input ("text" or "file" bytes) and enqueue it for the
+    inference workers. Returns the session_id immediately.
+    """
+    if not session_id:
+        session_id = str(uuid.uuid4())
+    if isinstance(payload, str):
+        payload = payload.encode("utf-8")
+
+    job = {"session_id": session_id, "kind": kind, "submitted_at": time.time()}
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.set(JOB_INPUT_KEY.format(session_id=session_id), payload, ex=JOB_INPUT_TTL)
+    pipe.lpush(JOB_QUEUE_KEY, json.dumps(job))
+    pipe.execute()
+    return session_id
+
+
+def pop_job(timeout=5):
+    """Block for the next job; returns (job, raw_input) or None on timeout."""
+    msg = redis_client.brpop(JOB_QUEUE_KEY, timeout=timeout)
+    if not msg:
+        return None
+
+    job = json.loads(msg[1])
+    input_key = JOB_INPUT_KEY.format(session_id=job["session_id"])
+    pipe = redis_client.pipeline(transaction=False)
+    pipe.get(input_key)
+    pipe.delete(input_key)
+    raw, _ = pipe.execute()
+    if raw is None:
+        return job, None
+    return job, raw.decode("utf-8") if job.get("kind") == "text" else raw
+
+
+# ------------------------------
+# Result notification (long-poll / SSE)
+# ------------------------------
+PROCESSED_KEY = "aegis:processed:{session_id}"
+NOTIFY_KEY = "aegis:notify:{session_id}"
+NOTIFY_TTL = 300
+
+
+def requeue_notify_token(pipe, notify_key, ttl=NOTIFY_TTL):
+    """
+    Queue the token re-push after a waiter's BLPOP, with EXPIRE: BLPOP
+    empties the list, which drops its TTL, and a bare RPUSH would leave
+    the key without one. Works on sync and asyncio pipelines alike.
+    """
+    pipe.rpush(notify_key, 1)
+    pipe.expire(notify_key, ttl)
+
+
+def queue_processed(pipe, session_id, processed, ttl=NOTIFY_TTL):
+    """
+    Add the processed-result write and the waiter wake-up for one session
+    to `pipe`; the one place that defines this hand-off (used by
+    store_processed_result and pathway_engine.consumer).
+    """
+    pipe.set(PROCESSED_KEY.format(session_id=session_id), json.dumps(processed), ex=ttl)
+    requeue_notify_token(pipe, NOTIFY_KEY.format(session_id=session_id), ttl)
+
+
+def store_processed_result(session_id, processed, ttl=NOTIFY_TTL, detections=None):
+    """
+    Write the processed result and wake anyone blocked on this session.
+    `detections` are pushed to the Pathway stream in the same round trip,
+    as publish_result does for synchronous requests, and the push count is
+    stored as `pathway_pushed`. Returns that count.
+    """
+    pipe = redis_client.pipeline(transaction=False)
+    count = 0
+    if detections is not None:
+        count = queue_scores(pipe, detections, session_id)
+        processed = {**processed, "pathway_pushed": count}
+    queue_processed(pipe, session_id, processed, ttl)
+    pipe.execute()
+    return count
+
+
+def wait_for_processed_result(session_id, timeout):
+    """
+    Like fetch_processed_result, but blocks up to `timeout` seconds on the
+    session's notify list instead of making the client poll.
+    """
+    data = fetch_processed_result(session_id)
+    if data is not None or timeout <= 0:
+        return data
+
+    notify_key = NOTIFY_KEY.format(session_id=session_id)
+    if get_redis(decode_responses=False, blocking=True).blpop(notify_key, timeout=timeout):
+        # Put the token back so other waiters on the same session wake too.
+        pipe = redis_client.pipeline(transaction=False)
+        requeue_notify_token(pipe, notify_key)
+        pipe.execute()
+    return fetch_processed_result(session_id)
+
+
+
+# ------------------------------
+# Stream consumer groups
+# ------------------------------
+class StreamConsumer:
+    """
+    One member of a Redis Streams consumer group.
+
+    read() returns up to `batch_size` (entry_id, payload) pairs. Every
+    `claim_idle_ms` it first takes over entries another consumer read but
+    never acknowledged (XAUTOCLAIM), so a crashed process loses nothing.
+    Call ack() with the ids once they are processed.
+    """
+
+    def __init__(self, client, stream, group, consumer=None, batch_size=100, block_ms=5000, claim_idle_ms=60000):
+        self.client = client
+        self.stream = stream
+        self.group = group
+        self.consumer = consumer or f"{socket.gethostname()}-{os.getpid()}"
+        self.batch_size = batch_size
+        self.block_ms = block_ms
+        self.claim_idle_ms = claim_idle_ms
+        self._next_claim = 0.0
+        self.ensure_group()
+
+    def ensure_group(self):
+        try:
+            self.client.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+        except redis.exceptions.ResponseError as e:
+            if "BUSYGROUP" not in str(e):
+                raise
+
+    @staticmethod
+    def _payloads(entries):
+        out = []
+        for entry_id, fields in entries:
+            if entry_id is None:  # trimmed by MAXLEN while pending
+                continue
+            out.append((entry_id, fields.get(STREAM_FIELD, fields.get(STREAM_FIELD.encode()))))
+        return out
+
+    def _claim(self):
+        if not self.claim_idle_ms or time.monotonic() < self._next_claim:
+            return []
+        self._next_claim = time.monotonic() + self.claim_idle_ms / 1000
+        resp = self.client.xautoclaim(
+            self.stream, self.group, self.consumer,
+            min_idle_time=self.claim_idle_ms, start_id="0-0", count=self.batch_size
+        )
+        claimed = self._payloads(resp[1])
+        if claimed:
+            print(f"[StreamConsumer] {self.consumer} reclaimed {len(claimed)} pending entries from '{self.stream}'")
+        return claimed
+
+    def read(self):
+        claimed = self._claim()
+        if claimed:
+            return claimed
+        try:
+            resp = self.client.xreadgroup(
+                self.group, self.consumer, {self.stream: ">"},
+                count=self.batch_size, block=self.block_ms
+            )
+        except redis.exceptions.ResponseError as e:
+            if "NOGROUP" not in str(e):
+                raise
+            self.ensure_group()  # stream or group was deleted under us
+            return []
+        return self._payloads(resp[0][1]) if resp else []
+
+    def ack(self, entry_ids):
+        if entry_ids:
+            self.client.xack(self.stream, self.group, *entry_ids)
@@ -0,0 +1,251 @@
+# ml_service/result_cache.py
+import copy
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+
+# ------------------------------
+# In-Process LRU Tier
+# ------------------------------
+class LRUCache:
+    """
+    Thread-safe LRU bounded by entry count and approximate byte size,
+    with a per-entry TTL (0 disables expiry).
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=16 * 1024 * 1024, ttl=300):
+        self.max_entries = max(int(max_entries), 1)
+        self.max_bytes = max(int(max_bytes), 1)
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (value, size, expires_at)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            value, size, expires_at = entry
+            if expires_at and expires_at < time.monotonic():
+                del self._data[key]
+                self._bytes -= size
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, size=1):
+        expires_at = time.monotonic() + self.ttl if self.ttl else 0
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= old[1]
+            self._data[key] = (value, size, expires_at)
+            self._bytes += size
+            while self._data and (len(self._data) > self.max_entries or self._bytes > self.max_bytes):
+                _, (_, evicted_size, _) = self._data.popitem(last=False)
+                self._bytes -= evicted_size
+                self.evictions += 1
+
+    def keys(self) -> list:
+        with self._lock:
+            return list(self._data)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._data),
+            "bytes": self._bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else 0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+# ------------------------------
+# Two-Tier Result Cache
+# ------------------------------
+class ResultCache:
+    """
+    Content-addressed cache for detect_pii results.
+
+    Keys hash the normalized input together with everything that can change
+    the output (threshold, page limit, model versions, input type). Lookups
+    go to the in-process LRU first, then to Redis when a client is given.
+    """
+
+    def __init__(self, memory: LRUCache, redis_client=None, redis_ttl=3600, prefix="aegis:cache:result:"):
+        self.memory = memory
+        self.redis = redis_client
+        self.redis_ttl = redis_ttl
+        self.prefix = prefix
+        self.redis_hits = 0
+        self.redis_errors = 0
+
+    @staticmethod
+    def make_key(input_type: str, payload: bytes, **params) -> str:
+        digest = hashlib.sha256()
+        digest.update(input_type.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(json.dumps(params, sort_keys=True, default=str).encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(payload)
+        return digest.hexdigest()
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is not None:
+            return copy.deepcopy(value)
+
+        if self.redis is not None:
+            try:
+                raw = self.redis.get(self.prefix + key)
+            except Exception as e:
+                self.redis_errors += 1
+                print(f"[ResultCache] Redis read failed: {e}")
+                raw = None
+            if raw is not None:
+                value = json.loads(raw)
+                self.redis_hits += 1
+                self.memory.set(key, value, size=len(raw))
+                return copy.deepcopy(value)
+
+        return None
+
+    def set(self, key, value):
+        raw = json.dumps(value)
+        self.memory.set(key, copy.deepcopy(value), size=len(raw))
+        if self.redis is not None:
+            try:
+                self.redis.set(self.prefix + key, raw, ex=self.redis_ttl or None)
+            except Exception as e:
+                self.redis_errors += 1
+                print(f"[ResultCache] Redis write failed: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "memory": self.memory.stats(),
+            "redis_enabled": self.redis is not None,
+            "redis_hits": self.redis_hits,
+            "redis_errors": self.redis_errors,
+        }
+
+
+# ------------------------------
+# Near-Duplicate Tier (perceptual hashes)
+# ------------------------------
+class NearDuplicateCache:
+    """
+    Cache keyed by perceptual image hashes (ints). get() returns the value
+    stored under the closest hash within `max_distance` differing bits,
+    scanning the bounded in-memory LRU. With a Redis client, entries are
+    persisted (one key each plus a recency index) and the memory tier is
+    warmed from Redis on first use.
+    """
+
+    def __init__(self, memory: LRUCache, max_distance=4, redis_client=None, redis_ttl=86400,
+                 prefix="aegis:cache:ocr:"):
+        self.memory = memory
+        self.max_distance = max_distance
+        self.redis = redis_client
+        self.redis_ttl = redis_ttl
+        self.prefix = prefix
+        self.index_key = prefix + "index"
+        self.exact_hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.redis_errors = 0
+        self._warmed = redis_client is None
+        self._lock = threading.Lock()
+
+    def _warm(self):
+        with self._lock:
+            if self._warmed:
+                return
+            self._warmed = True
+            try:
+                hashes = self.redis.zrevrange(self.index_key, 0, self.memory.max_entries - 1)
+                values = self.redis.mget([self.prefix + h.decode("ascii") for h in hashes]) if hashes else []
+            except Exception as e:
+                self.redis_errors += 1
+                print(f"[NearDuplicateCache] Redis warm-up failed: {e}")
+                return
+            for h, raw in zip(reversed(hashes), reversed(values)):  # oldest first, so LRU order matches
+                if raw is not None:
+                    value = raw.decode("utf-8")
+                    self.memory.set(int(h, 16), value, size=len(raw))
+            print(f"[NearDuplicateCache] Warmed {len(self.memory)} entries from Redis")
+
+    def get(self, image_hash: int):
+        self._warm()
+        value = self.memory.get(image_hash)
+        if value is not None:
+            self.exact_hits += 1
+            return value
+
+        best, best_distance = None, self.max_distance + 1
+        for key in self.memory.keys():
+            distance = bin(key ^ image_hash).count("1")
+            if distance < best_distance:
+                best, best_distance = key, distance
+        if best is not None:
+            value = self.memory.get(best)
+            if value is not None:
+                self.near_hits += 1
+                return value
+        self.misses += 1
+        return None
+
+    def set(self, image_hash: int, value: str):
+        self.memory.set(image_hash, value, size=len(value))
+        if self.redis is None:
+            return
+        field = format(image_hash, "x")
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            pipe.set(self.prefix + field, value, ex=self.redis_ttl or None)
+            pipe.zadd(self.index_key, {field: time.time()})
+            pipe.zremrangebyrank(self.index_key, 0, -(self.memory.max_entries + 1))
+            if self.redis_ttl:
+                pipe.expire(self.index_key, self.redis_ttl)
+            pipe.execute()
+        except Exception as e:
+            self.redis_errors += 1
+            print(f"[NearDuplicateCache] Redis write failed: {e}")
+
+    def stats(self) -> dict:
+        lookups = self.exact_hits + self.near_hits + self.misses
+        return {
+            "memory": self.memory.stats(),
+            "max_distance": self.max_distance,
+            "exact_hits": self.exact_hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "hit_rate": round((self.exact_hits + self.near_hits) / lookups, 3) if lookups else 0,
+            "redis_enabled": self.redis is not None,
+            "redis_errors": self.redis_errors,
+        }
@@ -0,0 +1,174 @@
+# ml_service/rule_engine.py
+import math
+import re
+from collections import Counter
+
+# ------------------------------
+# Checksums
+# ------------------------------
+_LUHN_DOUBLED = (0, 2, 4, 6, 8, 1, 3, 5, 7, 9)
+
+
+def luhn_valid(digits: str) -> bool:
+    total = 0
+    for i, ch in enumerate(reversed(digits)):
+        d = ord(ch) - 48
+        total += _LUHN_DOUBLED[d] if i % 2 else d
+    return total % 10 == 0
+
+
+_VERHOEFF_D = (
+    (0, 1, 2, 3, 4, 5, 6, 7, 8, 9), (1, 2, 3, 4, 0, 6, 7, 8, 9, 5),
+    (2, 3, 4, 0, 1, 7, 8, 9, 5, 6), (3, 4, 0, 1, 2, 8, 9, 5, 6, 7),
+    (4, 0, 1, 2, 3, 9, 5, 6, 7, 8), (5, 9, 8, 7, 6, 0, 4, 3, 2, 1),
+    (6, 5, 9, 8, 7, 1, 0, 4, 3, 2), (7, 6, 5, 9, 8, 2, 1, 0, 4, 3),
+    (8, 7, 6, 5, 9, 3, 2, 1, 0, 4), (9, 8, 7, 6, 5, 4, 3, 2, 1, 0),
+)
+_VERHOEFF_P = (
+    (0, 1, 2, 3, 4, 5, 6, 7, 8, 9), (1, 5, 7, 6, 2, 8, 3, 0, 9, 4),
+    (5, 8, 0, 3, 7, 9, 6, 1, 4, 2), (8, 9, 1, 6, 0, 4, 3, 5, 2, 7),
+    (9, 4, 5, 3, 1, 2, 6, 8, 7, 0), (4, 2, 8, 6, 5, 7, 3, 9, 0, 1),
+    (2, 7, 9, 3, 8, 0, 6, 4, 1, 5), (7, 0, 4, 6, 9, 1, 3, 2, 5, 8),
+)
+
+
+def verhoeff_valid(digits: str) -> bool:
+    c = 0
+    for i, ch in enumerate(reversed(digits)):
+        c = _VERHOEFF_D[c][_VERHOEFF_P[i % 8][ord(ch) - 48]]
+    return c == 0
+
+
+def shannon_entropy(value: str) -> float:
+    if not value:
+        return 0.0
+    n = len(value)
+    return -sum((k / n) * math.log2(k / n) for k in Counter(value).values())
+
+
+# ------------------------------
+# Validators (candidate text -> label or None)
+# ------------------------------
+MIN_SECRET_ENTROPY = 4.0
+
+
+def _digit_run(value):
+    digits = re.sub(r"[ -]", "", value)
+    if len(digits) == 12 and digits[0] not in "01" and verhoeff_valid(digits):
+        return "aadhar_number"
+    if 13 <= len(digits) <= 19 and luhn_valid(digits):
+        return "credit_card_number"
+    return None
+
+
+def _ssn(value):
+    area, group, serial = value.split("-")
+    if area in ("000", "666") or area[0] == "9" or group == "00" or serial == "0000":
+        return None
+    return "ssn"
+
+
+def _ip(value):
+    return "ip_address" if all(int(part) <= 255 for part in value.split(".")) else None
+
+
+# Unlabelled tokens must look like real keys (long, mixed case and digits,
+# high entropy); after a keyword such as "token:" or "api_key=" a weaker
+# shape is enough. Paths, slugs, UUIDs and git SHAs fail both.
+MIN_SECRET_LENGTH = 32
+MIN_KEYWORD_SECRET_ENTROPY = 3.0
+_SECRET_KEYWORD = re.compile(
+    r"(?i)(?:api[_ ]?key|secret|token|passw(?:or)?d|auth|bearer|credential)s?[\"']?\s*[:=]\s*[\"']?$"
+)
+
+
+def _generic_secret(value, before=""):
+    has_digit = any(c.isdigit() for c in value)
+    has_upper = any(c.isupper() for c in value)
+    has_lower = any(c.islower() for c in value)
+    entropy = shannon_entropy(value)
+    if _SECRET_KEYWORD.search(before):
+        return "api_key" if has_digit and entropy >= MIN_KEYWORD_SECRET_ENTROPY else None
+    if (len(value) >= MIN_SECRET_LENGTH and has_digit and has_upper and has_lower
+            and entropy >= MIN_SECRET_ENTROPY):
+        return "api_key"
+    return None
+
+
+# Order matters: at any position the first alternative that matches wins,
+# so specific formats come before the generic high-entropy token rule.
+_RULES = [
+    ("email", r"[A-Za-z0-9._%+\-]+@[A-Za-z0-9.\-]+\.[A-Za-z]{2,}", lambda v: "email"),
+    ("url", r"(?:https?://|www\.)[^\s<>\"']+[^\s<>\"'.,;:!?)]", lambda v: "url"),
+    ("jwt", r"eyJ[A-Za-z0-9_\-]{8,}\.[A-Za-z0-9_\-]{8,}\.[A-Za-z0-9_\-]{8,}", lambda v: "access_token"),
+    ("bearer", r"(?i:bearer)\s+[A-Za-z0-9._~+/\-]{16,}=*", lambda v: "access_token"),
+    ("known_token", r"(?:gh[pousr]_[A-Za-z0-9]{30,}|xox[abpr]-[A-Za-z0-9\-]{10,}|ya29\.[A-Za-z0-9_\-]{20,})",
+     lambda v: "access_token"),
+    ("known_key", r"(?:sk-(?:proj-|live_|test_)?[A-Za-z0-9_\-]{20,}|sk_(?:live|test)_[A-Za-z0-9]{16,}"
+                  r"|AKIA[0-9A-Z]{16}|AIza[0-9A-Za-z_\-]{35})", lambda v: "api_key"),
+    ("ip", r"(?<![\d.])(?:\d{1,3}\.){3}\d{1,3}(?![\d.])", _ip),
+    ("pan", r"(?<![A-Za-z0-9])[A-Z]{3}[ABCFGHLJPT][A-Z]\d{4}[A-Z](?![A-Za-z0-9])", lambda v: "pan_number"),
+    ("ssn", r"(?<![\d-])\d{3}-\d{2}-\d{4}(?![\d-])", _ssn),
+    ("digits", r"(?<![\d-])\d(?:[ -]?\d){11,18}(?![\d])", _digit_run),
+    ("secret", r"(?<![A-Za-z0-9_+/\-])[A-Za-z0-9_+]{24,128}={0,2}(?![A-Za-z0-9_+=/\-])", _generic_secret),
+]
+
+_COMBINED = re.compile("|".join(f"(?P<{name}>{pattern})" for name, pattern, _ in _RULES))
+_VALIDATORS = {name: validate for name, _, validate in _RULES}
+
+# GLiNER labels the rules fully cover (used by AEGIS_RULES=replace).
+RULE_LABELS = frozenset({
+    "email", "ip_address", "url", "credit_card_number", "pan_number",
+    "aadhar_number", "ssn", "api_key", "access_token",
+})
+
+
+def scan(text: str) -> list:
+    """
+    Single pass over `text` with one combined regex; each candidate is
+    checked by its validator (Luhn, Verhoeff, entropy, ranges). Returns
+    GLiNER-shaped entities: {label, text, start, end, score}.
+    """
+    entities = []
+    for m in _COMBINED.finditer(text):
+        name = m.lastgroup
+        value = m.group(name)
+        if name == "secret":
+            label = _generic_secret(value, text[max(m.start() - 40, 0):m.start()])
+        else:
+            label = _VALIDATORS[name](value)
+        if label:
+            entities.append({"label": label, "text": value, "start": m.start(), "end": m.end(), "score": 1.0})
+    return entities
+
+
+def align_entities(entities: list, text: str, normalize) -> list:
+    """
+    Re-anchor entities found in raw input onto `text`, its normalized form
+    (e.g. clean_ocr_text), so merge_entities can compare offsets with model
+    entities. Entities whose normalized value is not found keep start=end=-1.
+    """
+    aligned = []
+    pos = 0
+    for e in entities:
+        value = normalize(e["text"])
+        start = text.find(value, pos) if value else -1
+        if start < 0:
+            aligned.append({**e, "start": -1, "end": -1})
+            continue
+        pos = start + len(value)
+        aligned.append({**e, "text": value, "start": start, "end": pos})
+    return aligned
+
+
+def merge_entities(rule_entities: list, model_entities: list) -> list:
+    """Rule hits first; model entities overlapping a rule hit of the same label are dropped."""
+    if not rule_entities:
+        return list(model_entities)
+    merged = list(rule_entities)
+    for e in model_entities:
+        start, end = e.get("start", 0), e.get("end", 0)
+        if any(e["label"] == r["label"] and start < r["end"] and r["start"] < end for r in rule_entities):
+            continue
+        merged.append(e)
+    return merged
@@ -0,0 +1,70 @@
+# ml_service/tools/benchmark_backends.py
+"""
+Accuracy-vs-latency comparison of the classifier backends.
+
+Usage (from backend/):
+    python -m ml_service.tools.benchmark_backends [--corpus FILE] [--backends torch,onnx-int8] [--repeat 3]
+
+Every backend runs the same corpus through the production path
+(chunk_token_ids + classify_windows). Agreement and score drift are
+measured against eager fp32 torch.
+"""
+import argparse
+import time
+
+from ml_service.inference_backend import BACKENDS, load_sequence_classifier
+from ml_service.pii_detection import SELFHARM_MODEL_PATH, DISEASE_MODEL_PATH, chunk_token_ids, classify_windows
+from ml_service.tools.compare_fused import DEFAULT_CORPUS, load_corpus
+
+MODELS = {"selfharm": SELFHARM_MODEL_PATH, "disease": DISEASE_MODEL_PATH}
+
+
+def run_backend(classifier, windows_per_doc, repeat):
+    preds = [classify_windows(classifier, windows) for windows in windows_per_doc]
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for windows in windows_per_doc:
+            classify_windows(classifier, windows)
+    elapsed = (time.perf_counter() - started) / max(repeat, 1)
+    return preds, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare classifier backends on a fixed corpus.")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="text file, one document per line")
+    parser.add_argument("--backends", default=",".join(BACKENDS), help="comma-separated backends to compare")
+    parser.add_argument("--repeat", type=int, default=3, help="timed passes over the corpus")
+    args = parser.parse_args()
+
+    texts = load_corpus(args.corpus)
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    if "torch" not in backends:
+        backends.insert(0, "torch")
+
+    for name, path in MODELS.items():
+        print(f"\n=== {name} ({len(texts)} documents) ===")
+        baseline = None
+        for backend in backends:
+            try:
+                classifier = load_sequence_classifier(path, backend)
+            except Exception as e:
+                print(f"{backend:>11}: skipped ({e})")
+                continue
+
+            windows_per_doc = [chunk_token_ids(t, classifier.tokenizer) for t in texts]
+            preds, elapsed = run_backend(classifier, windows_per_doc, args.repeat)
+            flat = [p[0] if p else None for doc in preds for p in doc]
+            if baseline is None:
+                baseline = flat
+
+            pairs = [(a, b) for a, b in zip(baseline, flat) if a and b]
+            agreement = sum(a["label"] == b["label"] for a, b in pairs) / max(len(pairs), 1)
+            drift = sum(abs(a["score"] - b["score"]) for a, b in pairs) / max(len(pairs), 1)
+            print(
+                f"{backend:>11}: {elapsed * 1000 / max(len(texts), 1):8.2f} ms/doc  "
+                f"label agreement {agreement:.3f}  mean |score diff| {drift:.4f}"
+            )
+
+
+if __name__ == "__main__":
+    main()
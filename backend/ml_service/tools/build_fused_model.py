@@ -0,0 +1,33 @@
+# ml_service/tools/build_fused_model.py
+"""
+Build the fused self-harm + disease checkpoint.
+
+Usage (from backend/):
+    python -m ml_service.tools.build_fused_model [--backbone selfharm] [--output PATH]
+"""
+import argparse
+
+from ml_service.fused_classifier import build_fused_checkpoint
+from ml_service.pii_detection import SELFHARM_MODEL_PATH, DISEASE_MODEL_PATH, FUSED_MODEL_PATH
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fuse the self-harm and disease classifiers into one backbone.")
+    parser.add_argument("--selfharm", default=SELFHARM_MODEL_PATH, help="self-harm checkpoint directory")
+    parser.add_argument("--disease", default=DISEASE_MODEL_PATH, help="disease checkpoint directory")
+    parser.add_argument("--backbone", default="selfharm", choices=["selfharm", "disease"],
+                        help="which checkpoint provides the shared encoder")
+    parser.add_argument("--output", default=FUSED_MODEL_PATH, help="output directory")
+    args = parser.parse_args()
+
+    heads = build_fused_checkpoint(
+        {"selfharm": args.selfharm, "disease": args.disease},
+        args.output,
+        backbone=args.backbone
+    )
+    print(f"Fused checkpoint written to {args.output} (backbone: {args.backbone}, heads: {', '.join(heads)})")
+    print("Run `python -m ml_service.tools.compare_fused` to check agreement before enabling AEGIS_FUSED_CLASSIFIER.")
+
+
+if __name__ == "__main__":
+    main()
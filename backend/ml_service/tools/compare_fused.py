@@ -0,0 +1,82 @@
+# ml_service/tools/compare_fused.py
+"""
+Measure how closely the fused classifier agrees with the separate models.
+
+Usage (from backend/):
+    python -m ml_service.tools.compare_fused [--corpus FILE] [--fused PATH]
+
+Reports, per head: window-level top-1 label agreement, mean absolute score
+difference, document-level agreement of the final analyze_text flags, and
+wall time for both paths.
+"""
+import argparse
+import os
+import time
+
+from ml_service.fused_classifier import load_fused_classifier
+from ml_service.pii_detection import (
+    DISEASE_MODEL_PATH, FUSED_MODEL_PATH, SELFHARM_MODEL_PATH,
+    _load_classifier, _selfharm_results, _disease_results,
+    analyze_long_text_fused, analyze_long_text_multi,
+    chunk_token_ids, classify_windows, classify_windows_fused,
+)
+
+DEFAULT_CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "eval_corpus.txt")
+FLAGS = {"selfharm": _selfharm_results, "disease": _disease_results}
+
+
+def load_corpus(path):
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare fused vs. separate self-harm/disease classifiers.")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="text file, one document per line")
+    parser.add_argument("--fused", default=FUSED_MODEL_PATH, help="fused checkpoint directory")
+    args = parser.parse_args()
+
+    texts = load_corpus(args.corpus)
+    separate = {"selfharm": _load_classifier(SELFHARM_MODEL_PATH), "disease": _load_classifier(DISEASE_MODEL_PATH)}
+    fused = load_fused_classifier(args.fused)
+
+    window_total = 0
+    window_agree = {name: 0 for name in separate}
+    score_diff = {name: 0.0 for name in separate}
+    doc_agree = {name: 0 for name in separate}
+    separate_seconds = fused_seconds = 0.0
+
+    for text in texts:
+        windows = chunk_token_ids(text, fused.tokenizer)
+        fused_preds = classify_windows_fused(fused, windows)
+        for name, detector in separate.items():
+            for a, b in zip(classify_windows(detector, windows), fused_preds[name]):
+                if a is None or b is None:
+                    continue
+                window_agree[name] += a[0]["label"] == b[0]["label"]
+                score_diff[name] += abs(a[0]["score"] - b[0]["score"])
+        window_total += len(windows)
+
+        started = time.perf_counter()
+        separate_agg = analyze_long_text_multi(text, separate)
+        separate_seconds += time.perf_counter() - started
+
+        started = time.perf_counter()
+        fused_agg = analyze_long_text_fused(text, fused)
+        fused_seconds += time.perf_counter() - started
+
+        for name, to_flags in FLAGS.items():
+            doc_agree[name] += to_flags(separate_agg.get(name, [])) == to_flags(fused_agg.get(name, []))
+
+    print(f"Documents: {len(texts)}  Windows: {window_total}")
+    for name in separate:
+        print(
+            f"[{name}] window label agreement: {window_agree[name] / max(window_total, 1):.3f}  "
+            f"mean |score diff|: {score_diff[name] / max(window_total, 1):.4f}  "
+            f"document flag agreement: {doc_agree[name] / max(len(texts), 1):.3f}"
+        )
+    print(f"Separate models: {separate_seconds:.3f}s  Fused: {fused_seconds:.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+# ml_service/tools/export_classifiers.py
+"""
+Export the self-harm and disease classifiers to ONNX (fp32 + int8).
+
+Usage (from backend/):
+    python -m ml_service.tools.export_classifiers [--no-quantize]
+
+Writes <model>/onnx/model.onnx and <model>/onnx/model.int8.onnx, which the
+`onnx` and `onnx-int8` values of AEGIS_CLASSIFIER_BACKEND load.
+"""
+import argparse
+
+from ml_service.inference_backend import export_onnx
+from ml_service.pii_detection import SELFHARM_MODEL_PATH, DISEASE_MODEL_PATH
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export classifiers to ONNX / int8 ONNX.")
+    parser.add_argument("--no-quantize", action="store_true", help="only write the fp32 graph")
+    parser.add_argument("--opset", type=int, default=14)
+    args = parser.parse_args()
+
+    for name, path in (("selfharm", SELFHARM_MODEL_PATH), ("disease", DISEASE_MODEL_PATH)):
+        written = export_onnx(path, quantize=not args.no_quantize, opset=args.opset)
+        for out in written:
+            print(f"[{name}] wrote {out}")
+
+
+if __name__ == "__main__":
+    main()
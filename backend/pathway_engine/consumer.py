@@ -1,8 +1,13 @@
-import redis
+# Run from backend/: python -m pathway_engine.consumer
 import json
 import time
 
-r = redis.StrictRedis(host='localhost', port=6379, db=0)
+from ml_service.config import env_int
+from ml_service.redis_client import (
+    RESULT_GROUP, RESULT_QUEUE_KEY, RESULT_XSTREAM_KEY, USE_STREAMS, StreamConsumer, get_redis, queue_processed
+)
+
+r = get_redis(decode_responses=False)
 
 def process_data(result_data):
     """
@@ -11,7 +16,7 @@ def process_data(result_data):
     """
     try:
         labels = [item["label"] for item in result_data]
-        scores = [item["score"] for item in result_data]
+        scores = [item.get("score", item.get("sensitivity_score", 0)) for item in result_data]
         avg_score = sum(scores)/len(scores) if scores else 0
 
         severity = (
@@ -32,10 +37,13 @@ def process_data(result_data):
 
 
 def main():
+    if USE_STREAMS:
+        return main_streams()
+
     print("[Pathway Engine] Listening for Redis queue jobs...")
 
     while True:
-        msg = r.brpop("aegis:results", timeout=0)
+        msg = r.brpop(RESULT_QUEUE_KEY, timeout=0)
         if not msg:
             continue
 
@@ -48,8 +56,42 @@ def main():
         print(f"[Pathway Engine] Processing session {session_id}...")
         processed = process_data(result_data)
 
-        r.set(f"aegis:processed:{session_id}", json.dumps(processed), ex=300)
+        pipe = r.pipeline(transaction=False)
+        queue_processed(pipe, session_id, processed)  # also wakes long-poll / SSE waiters
+        pipe.execute()
         print(f"[Pathway Engine] ✔ Stored processed result for {session_id}")
 
+
+def main_streams():
+    """
+    Consumer-group mode (AEGIS_USE_STREAMS=1): run any number of these.
+    Each batch is stored and acknowledged in one pipeline; entries left
+    unacknowledged by a crashed consumer are reclaimed by another one.
+    """
+    reader = StreamConsumer(
+        r, RESULT_XSTREAM_KEY, RESULT_GROUP,
+        batch_size=env_int("AEGIS_CONSUMER_BATCH", 100),
+        claim_idle_ms=env_int("AEGIS_STREAM_CLAIM_IDLE_MS", 60000)
+    )
+    print(f"[Pathway Engine] Consumer {reader.consumer} reading stream '{RESULT_XSTREAM_KEY}'...")
+
+    while True:
+        entries = reader.read()
+        if not entries:
+            continue
+
+        pipe = r.pipeline(transaction=False)
+        for entry_id, raw in entries:
+            try:
+                data = json.loads(raw)
+                queue_processed(pipe, data["session_id"], process_data(data["result_data"]))
+            except (TypeError, ValueError, KeyError) as e:
+                # Acked anyway: a malformed entry would otherwise be reclaimed forever.
+                print(f"[Pathway Engine] Skipping malformed entry {entry_id}: {e}")
+        pipe.xack(RESULT_XSTREAM_KEY, RESULT_GROUP, *[entry_id for entry_id, _ in entries])
+        pipe.execute()
+        print(f"[Pathway Engine] ✔ Stored {len(entries)} processed results")
+
+
 if __name__ == "__main__":
     main()
@@ -1,18 +1,99 @@
+# Run from backend/: python -m pathway_engine.pipeline
 import pathway as pw
 import redis
 import json
 import time
 
+from ml_service.config import env_int
+from pathway_engine.sketches import HyperLogLog, KLLSketch
+from ml_service.redis_client import (
+    BUCKET_GLOBAL_FIELD, BUCKET_KEY, BUCKET_RETENTION, GLOBAL_STATS_KEY, LABEL_SKETCH_KEY, LABEL_STATS_KEY,
+    SCORE_GROUP, SCORE_XSTREAM_KEY, SKETCH_KEY, USE_STREAMS, StreamConsumer, get_redis, redis_settings
+)
+
 class ScoreSchema(pw.Schema):  # defining the structure of input
     score: float
     label: str
+    ts: float  # event time (epoch seconds), set by redis_client.queue_scores
+    session_id: str  # "" for rows pushed without a session (e.g. /api/score/)
 
 class RedisScoreReader(pw.io.python.ConnectorSubject):  # python connector that reads from redis
-    def __init__(self, host='localhost', port=6379, list_key="scores_stream"):
+    def __init__(self, host=None, port=None, list_key="scores_stream", use_streams=None):
         super().__init__()
-        self.host = host
-        self.port = port
+        self.host = host or redis_settings()["host"]
+        self.port = port or redis_settings()["port"]
         self.list_key = list_key
+        self.use_streams = USE_STREAMS if use_streams is None else use_streams
+        self.batch_size = max(env_int("AEGIS_SCORE_BATCH", 500), 1)
+        self.log_every = env_int("AEGIS_READER_LOG_SECONDS", 30)
+        self._rows = 0
+        self._batches = 0
+        self._window_start = time.monotonic()
+
+    def _record(self, batch_len):
+        """Rows/sec and average batch fill, printed every AEGIS_READER_LOG_SECONDS."""
+        self._rows += batch_len
+        self._batches += 1
+        elapsed = time.monotonic() - self._window_start
+        if self.log_every and elapsed >= self.log_every:
+            fill = self._rows / (self._batches * self.batch_size)
+            print(f"RedisScoreReader: {self._rows / elapsed:.1f} rows/s, "
+                  f"{self._batches} batches, avg fill {fill:.0%} of {self.batch_size}")
+            self._rows = self._batches = 0
+            self._window_start = time.monotonic()
+
+    def _emit_batch(self, batch):
+        """Parse a whole batch with one json.loads; fall back to per-item on bad input."""
+        batch = [data.decode("utf-8", "replace") if isinstance(data, bytes) else data for data in batch]
+        if not all(isinstance(data, str) for data in batch):  # e.g. None; dropped (and acked in stream mode)
+            print(f"Warning: Dropping non-string payloads: {[data for data in batch if not isinstance(data, str)]}")
+            batch = [data for data in batch if isinstance(data, str)]
+        if not batch:
+            return
+        try:
+            payloads = json.loads("[" + ",".join(batch) + "]")
+        except ValueError:
+            payloads = None
+        if payloads is None or len(payloads) != len(batch):  # a bad item can also shift the split
+            for data in batch:
+                self._emit(data)
+            return
+        for data, payload in zip(batch, payloads):
+            self._next(data, payload)
+
+    def _emit(self, data):
+        try:
+            payload = json.loads(data)  # parsing the incoming JSON
+        except (TypeError, ValueError):
+            print(f"Warning: Received invalid JSON: {data}")
+            return
+        self._next(data, payload)
+
+    def _next(self, data, payload):
+        try:
+            # self.next() sends the data into the Pathway pipeline
+            self.next(score=float(payload['score']), label=payload['label'], ts=float(payload.get('ts') or time.time()),
+                      session_id=str(payload.get('session_id') or ''))
+        except KeyError:
+            print(f"Warning: Received JSON missing 'score' or 'label': {data}")
+        except (AttributeError, TypeError, ValueError):  # not an object, or a non-numeric score / ts
+            print(f"Warning: Received JSON with invalid fields: {data}")
+
+    def _run_streams(self):
+        """Consumer-group read of aegis:scores:stream; entries are acked once handed to Pathway."""
+        reader = StreamConsumer(
+            self.rd, SCORE_XSTREAM_KEY, SCORE_GROUP,
+            batch_size=self.batch_size,
+            claim_idle_ms=env_int("AEGIS_STREAM_CLAIM_IDLE_MS", 60000)
+        )
+        print(f"RedisScoreReader: Connected. Reading stream '{SCORE_XSTREAM_KEY}' as {reader.consumer}...")
+        while True:
+            entries = reader.read()
+            if not entries:
+                continue
+            self._emit_batch([data for _, data in entries])
+            reader.ack([entry_id for entry_id, _ in entries])
+            self._record(len(entries))
 
     def run(self):
         """This method runs in a separate thread, managed by Pathway."""
@@ -20,21 +101,19 @@ class RedisScoreReader(pw.io.python.ConnectorSubject):  # python connector that
         
         while True:
             try:
-                self.rd = redis.Redis(host=self.host, port=self.port, decode_responses=True)  # establishing connection
+                self.rd = get_redis(host=self.host, port=self.port)  # establishing connection
                 self.rd.ping()  # to test connection
+                if self.use_streams:
+                    self._run_streams()
                 print(f"RedisScoreReader: Connected. Listening to list '{self.list_key}'...")
             
-                while True:  # loop that listens to pop
+                while True:  # block for the first item, then drain up to batch_size in one round trip
                     source_list, data = self.rd.blpop(self.list_key)  # to wait for a new line to arrive
-                    
-                    try:
-                        payload = json.loads(data)  # parsing the incoming JSON
-                        # self.next() sends the data into the Pathway pipeline
-                        self.next(score=payload['score'], label=payload['label'])
-                    except json.JSONDecodeError:
-                        print(f"Warning: Received invalid JSON: {data}")
-                    except KeyError:
-                        print(f"Warning: Received JSON missing 'score' or 'label': {data}")
+                    batch = [data]
+                    if self.batch_size > 1:
+                        batch += self.rd.lpop(self.list_key, self.batch_size - 1) or []
+                    self._emit_batch(batch)
+                    self._record(len(batch))
 
             except redis.exceptions.ConnectionError as e:
                 print(f"RedisScoreReader connection error: {e}. Retrying in 5 seconds...")
@@ -45,75 +124,246 @@ class RedisScoreReader(pw.io.python.ConnectorSubject):  # python connector that
         
         print("RedisScoreReader is closing.")
 
-class RedisSingleValueWriter(pw.io.python.ConnectorObserver):  # output connector to write a single value to redis
-    def __init__(self, host='localhost', port=6379, key=""): 
+class RedisHashRowWriter(pw.io.python.ConnectorObserver):  # coalesced writer for single-row stats tables
+    """
+    Keeps the latest row from on_change and writes all of its columns with
+    one HSET per Pathway commit (on_time_end). `field_map` renames columns.
+    """
+
+    def __init__(self, host=None, port=None, key=GLOBAL_STATS_KEY, field_map=None):
         super().__init__()
-        self.host = host
-        self.port = port
-        self.key = key  # the redis key we will write to
+        self.host = host or redis_settings()["host"]
+        self.port = port or redis_settings()["port"]
+        self.key = key
+        self.field_map = field_map or {}
+        self.pending = None
+        self.writes = 0
+        self.log_every = env_int("AEGIS_WRITER_LOG_SECONDS", 30)
+        self._last_log = 0.0
         try:
-            self.rd = redis.Redis(host=self.host, port=self.port, decode_responses=True)
+            self.rd = get_redis(host=self.host, port=self.port)
             self.rd.ping()
-            print(f"RedisSingleValueWriter: Connected to Redis. Will write to key '{self.key}'")
+            print(f"RedisHashRowWriter: Connected to Redis. Will write to hash '{self.key}'")
         except redis.exceptions.ConnectionError as e:
-            print(f"RedisSingleValueWriter: FAILED to connect to Redis at {self.host}:{self.port}. Error: {e}")
+            print(f"RedisHashRowWriter: FAILED to connect to Redis at {self.host}:{self.port}. Error: {e}")
             raise
 
-    def on_change(self, key, row, time, is_addition):  # method called whenever the value updates
-        if is_addition:  # to only act when values are inserted
-            value_to_write = next(iter(row.values())) # get the first (and only) value from the row
-            try:
-                self.rd.set(self.key, value_to_write)
-                print(f"Updated simple value in Redis at key '{self.key}' to: {value_to_write}")
-            except redis.exceptions.ConnectionError as e:
-                print(f"RedisSingleValueWriter: Could not write to Redis. Error: {e}")
+    def on_change(self, key, row, time, is_addition):  # only buffers; the write happens once per commit
+        if is_addition:
+            self.pending = row
+
+    def on_time_end(self, time):
+        if self.pending is None:
+            return
+        mapping = {self.field_map.get(name, name): value for name, value in self.pending.items()}
+        self.pending = None
+        try:
+            self.rd.hset(self.key, mapping=mapping)
+            self.writes += 1
+        except redis.exceptions.ConnectionError as e:
+            print(f"RedisHashRowWriter: Could not write to Redis. Error: {e}")
+            return
+        self._log(mapping)
+
+    def _log(self, mapping):  # rate-limited; `time` is shadowed in the observer callbacks
+        now = time.monotonic()
+        if now - self._last_log >= self.log_every:
+            print(f"Updated hash '{self.key}' ({self.writes} writes so far, fields: {', '.join(mapping)})")
+            self._last_log = now
 
     def on_end(self):
-        print("Stream has ended. RedisSingleValueWriter closing.")
+        print("Stream has ended. RedisHashRowWriter closing.")
 
-class RedisJsonDictWriter(pw.io.python.ConnectorObserver):  
-    def __init__(self, host='localhost', port=6379, key=""):
+class RedisLabelHashWriter(pw.io.python.ConnectorObserver):  # per-label stats, one hash field per label
+    """
+    Buffers per-label changes and, once per Pathway commit, HSETs the
+    labels that changed and HDELs the ones that disappeared, so the cost of
+    an update does not grow with the number of labels.
+    """
+
+    def __init__(self, host=None, port=None, key=LABEL_STATS_KEY):
         super().__init__()
-        self.host = host
-        self.port = port
-        self.key = key 
-        self.current_state = {}  
+        self.host = host or redis_settings()["host"]
+        self.port = port or redis_settings()["port"]
+        self.key = key
+        self.pending = {}  # label -> JSON row, or None to delete
         try:
-            self.rd = redis.Redis(host=self.host, port=self.port, decode_responses=True)
+            self.rd = get_redis(host=self.host, port=self.port)
             self.rd.ping()
-            print(f"RedisJsonDictWriter: Connected to Redis. Will write to key '{self.key}'")
+            print(f"RedisLabelHashWriter: Connected to Redis. Will write to hash '{self.key}'")
         except redis.exceptions.ConnectionError as e:
-            print(f"RedisJsonDictWriter: FAILED to connect. Error: {e}")
+            print(f"RedisLabelHashWriter: FAILED to connect. Error: {e}")
             raise
 
-    def on_change(self, key, row, time, is_addition):  # key is the Pointer, row is the data
-
-        if is_addition:  
-            self.current_state[key] = row
+    def on_change(self, key, row, time, is_addition):  # an update arrives as retraction + addition
+        label = row['label']
+        if is_addition:
+            self.pending[label] = json.dumps(row)
         else:
-            self.current_state.pop(key, None)
-        
-        output_dict = {}  # creating a dictionary for json output
-        for row_data in self.current_state.values():
-            label_key = row_data['label'] 
-            output_dict[label_key] = row_data  # using label 
-        
+            self.pending.setdefault(label, None)
+
+    def on_time_end(self, time):
+        if not self.pending:
+            return
+        updates = {label: row for label, row in self.pending.items() if row is not None}
+        removed = [label for label, row in self.pending.items() if row is None]
+        self.pending = {}
+        try:
+            pipe = self.rd.pipeline(transaction=False)
+            if updates:
+                pipe.hset(self.key, mapping=updates)
+            if removed:
+                pipe.hdel(self.key, *removed)
+            pipe.execute()
+        except redis.exceptions.ConnectionError as e:
+            print(f"RedisLabelHashWriter: Could not write to Redis. Error: {e}")
+
+    def on_end(self):
+        print("Stream has ended. RedisLabelHashWriter closing.")
+
+
+class ScoreQuantileAccumulator(pw.BaseCustomAccumulator):  # KLL sketch of scores, serialized as result
+    def __init__(self, sketch):
+        self.sketch = sketch
+
+    @classmethod
+    def from_row(cls, row):
+        [score] = row
+        sketch = KLLSketch()
+        sketch.update(score)
+        return cls(sketch)
+
+    def update(self, other):
+        self.sketch.merge(other.sketch)
+
+    def compute_result(self) -> str:
+        return self.sketch.serialize()
+
+
+class DistinctCountAccumulator(pw.BaseCustomAccumulator):  # HyperLogLog of non-empty values
+    def __init__(self, hll):
+        self.hll = hll
+
+    @classmethod
+    def from_row(cls, row):
+        [value] = row
+        hll = HyperLogLog()
+        if value:
+            hll.add(value)
+        return cls(hll)
+
+    def update(self, other):
+        self.hll.merge(other.hll)
+
+    def compute_result(self) -> str:
+        return self.hll.serialize()
+
+
+score_sketch = pw.reducers.udf_reducer(ScoreQuantileAccumulator)
+session_sketch = pw.reducers.udf_reducer(DistinctCountAccumulator)
+
+
+def sketch_quantile(serialized, q):
+    return KLLSketch.deserialize(serialized).quantile(q)
+
+
+def sketch_count(serialized):
+    return HyperLogLog.deserialize(serialized).count()
+
+
+def with_sketch_summaries(table):
+    """Adds score_p50/p95/p99 and distinct_sessions columns derived from the sketch columns."""
+    return table.with_columns(
+        score_p50=pw.apply_with_type(lambda s: sketch_quantile(s, 0.50), float, pw.this.score_sketch),
+        score_p95=pw.apply_with_type(lambda s: sketch_quantile(s, 0.95), float, pw.this.score_sketch),
+        score_p99=pw.apply_with_type(lambda s: sketch_quantile(s, 0.99), float, pw.this.score_sketch),
+        distinct_sessions=pw.apply_with_type(sketch_count, int, pw.this.session_sketch),
+    )
+
+
+class RedisBucketWriter(pw.io.python.ConnectorObserver):  # time-bucket series with retention
+    """
+    Writes tumbling-window rows to stats:bucket:{seconds}:{window_start},
+    one hash field per label (BUCKET_GLOBAL_FIELD for the all-label row).
+    Each bucket key expires after `retention` seconds; retractions are
+    ignored, so closed buckets stay readable until then.
+    """
+
+    def __init__(self, seconds, retention, host=None, port=None):
+        super().__init__()
+        self.host = host or redis_settings()["host"]
+        self.port = port or redis_settings()["port"]
+        self.seconds = seconds
+        self.retention = retention
+        self.pending = {}  # (bucket key, field) -> JSON row
         try:
-            json_data = json.dumps(output_dict) 
-            self.rd.set(self.key, json_data)
-            print(f"Updated JSON Dict in Redis at key '{self.key}'")
+            self.rd = get_redis(host=self.host, port=self.port)
+            self.rd.ping()
+            print(f"RedisBucketWriter: Connected to Redis. Will write {seconds}s buckets")
+        except redis.exceptions.ConnectionError as e:
+            print(f"RedisBucketWriter: FAILED to connect. Error: {e}")
+            raise
+
+    def on_change(self, key, row, time, is_addition):
+        if not is_addition:
+            return
+        bucket_key = BUCKET_KEY.format(seconds=self.seconds, start=int(row['window_start']))
+        field = row.get('label', BUCKET_GLOBAL_FIELD)
+        self.pending[(bucket_key, field)] = json.dumps(
+            {name: value for name, value in row.items() if name not in ('label', 'window_start')}
+        )
+
+    def on_time_end(self, time):
+        if not self.pending:
+            return
+        by_key = {}
+        for (bucket_key, field), value in self.pending.items():
+            by_key.setdefault(bucket_key, {})[field] = value
+        self.pending = {}
+        try:
+            pipe = self.rd.pipeline(transaction=False)
+            for bucket_key, mapping in by_key.items():
+                pipe.hset(bucket_key, mapping=mapping)
+                pipe.expire(bucket_key, self.retention)
+            pipe.execute()
         except redis.exceptions.ConnectionError as e:
-            print(f"RedisJsonDictWriter: Could not write to Redis. Error: {e}")
+            print(f"RedisBucketWriter: Could not write to Redis. Error: {e}")
 
     def on_end(self):
-        print("Stream has ended. RedisJsonDictWriter closing.")
+        print("Stream has ended. RedisBucketWriter closing.")
+
+
+def bucket_stats(t_scores, seconds, by_label=False):
+    """
+    Tumbling `seconds`-wide windows over event time, globally or per label.
+    Windows are dropped from Pathway state once older than one window (at
+    least 60 s, so short buckets still accept slightly late scores), so
+    memory stays bounded; the Redis buckets keep the history.
+    """
+    windowed = t_scores.windowby(
+        pw.this.ts,
+        window=pw.temporal.tumbling(duration=float(seconds)),
+        instance=pw.this.label if by_label else None,
+        behavior=pw.temporal.common_behavior(cutoff=float(max(seconds, 60)), keep_results=False),
+    )
+    columns = dict(
+        window_start=pw.this._pw_window_start,
+        count=pw.reducers.count(),
+        sum_score=pw.reducers.sum(pw.this.score),
+        max_score=pw.reducers.max(pw.this.score),
+        min_score=pw.reducers.min(pw.this.score),
+        count_high=pw.reducers.sum(pw.if_else(pw.this.score > 90, 1, 0)),
+    )
+    if by_label:
+        columns["label"] = pw.this._pw_instance
+    return windowed.reduce(**columns)
 
 
 def run_pipeline():  # constructing and running the pipeline
     print("Pathway pipeline starting...")
 
     t_scores = pw.io.python.read(
-        RedisScoreReader(host='localhost', port=6379, list_key='scores_stream'),
+        RedisScoreReader(list_key='scores_stream'),
         schema=ScoreSchema,
         autocommit_duration_ms=1000
     )
@@ -129,6 +379,9 @@ def run_pipeline():  # constructing and running the pipeline
         count_low=pw.reducers.sum(pw.if_else(pw.this.score <= 50, 1, 0)),  # score distribution brackets
         count_medium=pw.reducers.sum(pw.if_else((pw.this.score > 50) & (pw.this.score <= 90), 1, 0)),
         count_high=pw.reducers.sum(pw.if_else(pw.this.score > 90, 1, 0)),
+
+        score_sketch=score_sketch(pw.this.score),  # fixed-size KLL / HyperLogLog state
+        session_sketch=session_sketch(pw.this.session_id),
     )
 
     t_global_stats = t_global_stats_base.with_columns(  # percentage of scores that are "high"
@@ -138,39 +391,16 @@ def run_pipeline():  # constructing and running the pipeline
             0  # Default to 0 if total_scores is 0
         )
     )
+    t_global_stats = with_sketch_summaries(t_global_stats)  # p50/p95/p99 + distinct sessions
     
-    # --- writing all 9 global stats to redis ---
-    pw.io.python.write(
-        t_global_stats.select(pw.this.average_score),
-        RedisSingleValueWriter(host='localhost', port=6379, key='current_average')
-    )
-    pw.io.python.write(
-        t_global_stats.select(pw.this.highest_score),
-        RedisSingleValueWriter(host='localhost', port=6379, key='highest_score')
-    )
-    pw.io.python.write(
-        t_global_stats.select(pw.this.lowest_score),
-        RedisSingleValueWriter(host='localhost', port=6379, key='lowest_score')
-    )
-    pw.io.python.write(
-        t_global_stats.select(pw.this.total_scores),
-        RedisSingleValueWriter(host='localhost', port=6379, key='total_scores')
-    )
-    pw.io.python.write(
-        t_global_stats.select(pw.this.count_low),
-        RedisSingleValueWriter(host='localhost', port=6379, key='count_low')
-    )
+    # --- all global stats in one hash, one HSET per commit ---
     pw.io.python.write(
-        t_global_stats.select(pw.this.count_medium),
-        RedisSingleValueWriter(host='localhost', port=6379, key='count_medium')
+        t_global_stats.without(pw.this.score_sketch, pw.this.session_sketch),
+        RedisHashRowWriter(field_map={'average_score': 'current_average'})
     )
     pw.io.python.write(
-        t_global_stats.select(pw.this.count_high),
-        RedisSingleValueWriter(host='localhost', port=6379, key='count_high') # Replaces old 'high_score_count'
-    )
-    pw.io.python.write(
-        t_global_stats.select(pw.this.percent_high_score),
-        RedisSingleValueWriter(host='localhost', port=6379, key='percent_high_score')
+        t_global_stats.select(pw.this.score_sketch, pw.this.session_sketch),
+        RedisHashRowWriter(key=SKETCH_KEY, field_map={'score_sketch': 'scores', 'session_sketch': 'sessions'})
     )
 
     # --- per label statistics ---
@@ -181,13 +411,19 @@ def run_pipeline():  # constructing and running the pipeline
         count=pw.reducers.count(),
         avg_score=pw.reducers.avg(pw.this.score),
         max_score=pw.reducers.max(pw.this.score),
-        min_score=pw.reducers.min(pw.this.score)
+        min_score=pw.reducers.min(pw.this.score),
+        score_sketch=score_sketch(pw.this.score),
+        session_sketch=session_sketch(pw.this.session_id),
     )
-    t_label_stats_with_id = t_label_stats.with_id_from(pw.this.label)
+    t_label_stats_with_id = with_sketch_summaries(t_label_stats).with_id_from(pw.this.label)
 
     pw.io.python.write(
-        t_label_stats_with_id,
-        RedisJsonDictWriter(host='localhost', port=6379, key='stats_by_label')
+        t_label_stats_with_id.without(pw.this.score_sketch, pw.this.session_sketch),
+        RedisLabelHashWriter()
+    )
+    pw.io.python.write(
+        t_label_stats_with_id.select(pw.this.label, pw.this.score_sketch, pw.this.session_sketch),
+        RedisLabelHashWriter(key=LABEL_SKETCH_KEY)
     )
 
     t_unique_label_count = t_label_stats.groupby().reduce(
@@ -196,9 +432,17 @@ def run_pipeline():  # constructing and running the pipeline
     
     pw.io.python.write(
         t_unique_label_count.select(pw.this.unique_label_count),
-        RedisSingleValueWriter(host='localhost', port=6379, key='unique_label_count')
+        RedisHashRowWriter()
     )
 
+    # --- time-bucketed series for /api/stats/?window= ---
+    for seconds, retention in BUCKET_RETENTION.items():
+        for by_label in (False, True):
+            pw.io.python.write(
+                bucket_stats(t_scores, seconds, by_label),
+                RedisBucketWriter(seconds, retention)
+            )
+
     print("Running Pathway pipeline with all new analytics...")
     pw.run() 
 
@@ -0,0 +1,75 @@
+# tests/test_ingest.py
+import base64
+import io
+
+import pytest
+
+pytest.importorskip("magic")
+Image = pytest.importorskip("PIL.Image")
+
+from ml_service import ingest
+from ml_service.ingest import UploadRejected, decode_base64
+
+
+def png_bytes(width, height, padding=0):
+    buf = io.BytesIO()
+    Image.new("RGB", (width, height), "white").save(buf, format="PNG")
+    return buf.getvalue() + b"\0" * padding
+
+
+def b64(data):
+    return base64.b64encode(data).decode("ascii")
+
+
+# ------------------------------
+# Known-good vectors
+# ------------------------------
+def test_decodes_plain_base64():
+    data = png_bytes(32, 16)
+    assert bytes(decode_base64(b64(data))) == data
+
+
+def test_decodes_data_url_with_line_breaks():
+    data = png_bytes(64, 64, padding=600_000)  # spans several decode slices
+    encoded = b64(data)
+    wrapped = "\n".join(encoded[i:i + 76] for i in range(0, len(encoded), 76))
+    assert bytes(decode_base64("data:image/png;base64," + wrapped)) == data
+
+
+# ------------------------------
+# Known-bad vectors
+# ------------------------------
+def test_rejects_empty_payload():
+    with pytest.raises(UploadRejected) as e:
+        decode_base64("")
+    assert e.value.status == 400
+
+
+def test_rejects_invalid_base64():
+    with pytest.raises(UploadRejected) as e:
+        decode_base64("data:image/png;base64,abc")
+    assert e.value.status == 400
+
+
+def test_rejects_unsupported_type():
+    with pytest.raises(UploadRejected) as e:
+        decode_base64(b64(b"just some text, not an image " * 200))
+    assert e.value.status == 415
+
+
+def test_rejects_oversized_payload(monkeypatch):
+    monkeypatch.setattr(ingest, "MAX_UPLOAD_BYTES", 1024)
+    with pytest.raises(UploadRejected) as e:
+        decode_base64(b64(png_bytes(8, 8, padding=4096)))
+    assert e.value.status == 413
+
+
+def test_rejects_too_many_pixels_before_decoding_the_rest(monkeypatch):
+    monkeypatch.setattr(ingest, "MAX_IMAGE_PIXELS", 100)
+    calls = []
+    a2b = ingest.binascii.a2b_base64
+    monkeypatch.setattr(ingest.binascii, "a2b_base64", lambda s: calls.append(len(s)) or a2b(s))
+    with pytest.raises(UploadRejected) as e:
+        decode_base64(b64(png_bytes(20, 20, padding=4 * ingest.CHUNK_BYTES)))
+    assert e.value.status == 413
+    assert len(calls) == 1
@@ -0,0 +1,116 @@
+# tests/test_redis_client.py
+import json
+
+import pytest
+
+pytest.importorskip("redis")
+
+from ml_service import redis_client
+from ml_service.redis_client import SCORE_STREAM_KEY, queue_scores
+
+
+class RecordingPipe:
+    def __init__(self):
+        self.calls = []
+
+    def rpush(self, key, *values):
+        self.calls.append((key, values))
+
+
+@pytest.fixture(autouse=True)
+def list_mode(monkeypatch):
+    monkeypatch.setattr(redis_client, "USE_STREAMS", False)
+
+
+def test_detect_pii_results_become_session_rows():
+    detections = [
+        {"label": "email", "sensitivity_score": 0.6},
+        {"label": "credit_card_number", "sensitivity_score": 1.0},
+        {"label": "self_harm_risk", "sensitivity_score": 1.0},
+    ]
+    pipe = RecordingPipe()
+    assert queue_scores(pipe, detections, "session-1") == 3
+
+    [(key, payloads)] = pipe.calls
+    rows = [json.loads(p) for p in payloads]
+    assert key == SCORE_STREAM_KEY
+    assert [row["session_id"] for row in rows] == ["session-1"] * 3
+    assert [row["score"] for row in rows] == [60.0, 100.0, 100.0]
+    assert all(isinstance(row["ts"], float) for row in rows)
+
+
+def test_explicit_score_is_kept_and_unscored_items_are_skipped():
+    pipe = RecordingPipe()
+    items = [{"label": "manual", "score": 42.0}, {"label": "no_score"}, "not a dict", {"score": 1}]
+    assert queue_scores(pipe, items) == 1
+    [row] = [json.loads(p) for p in pipe.calls[0][1]]
+    assert row["score"] == 42.0 and "session_id" not in row
+
+
+def test_error_results_push_nothing():
+    pipe = RecordingPipe()
+    assert queue_scores(pipe, {"error": "No text detected in file."}, "session-1") == 0
+    assert pipe.calls == []
+
+
+# ------------------------------
+# Sync and async-job hand-off
+# ------------------------------
+class FakePipeline(RecordingPipe):
+    def __init__(self):
+        super().__init__()
+        self.values = {}
+        self.ttls = {}
+
+    def lpush(self, key, *values):
+        self.calls.append((key, values))
+
+    def set(self, key, value, ex=None):
+        self.values[key] = value
+
+    def expire(self, key, ttl):
+        self.ttls[key] = ttl
+
+    def execute(self):
+        return []
+
+
+class FakeRedis:
+    def __init__(self):
+        self.pipe = FakePipeline()
+
+    def pipeline(self, transaction=True):
+        return self.pipe
+
+
+DETECTIONS = [{"label": "email", "sensitivity_score": 0.6}, {"label": "phone_number", "sensitivity_score": 0.7}]
+
+
+def score_rows(pipe):
+    return [json.loads(p) for key, values in pipe.calls if key == SCORE_STREAM_KEY for p in values]
+
+
+def test_publish_result_pushes_detections(monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(redis_client, "redis_client", fake)
+    session_id, pushed = redis_client.publish_result(DETECTIONS)
+    assert pushed == 2
+    assert {row["session_id"] for row in score_rows(fake.pipe)} == {session_id}
+
+
+def test_async_job_result_pushes_detections(monkeypatch):
+    fake = FakeRedis()
+    monkeypatch.setattr(redis_client, "redis_client", fake)
+    pushed = redis_client.store_processed_result("job-1", {"severity": "medium"}, detections=DETECTIONS)
+    assert pushed == 2
+    assert [row["session_id"] for row in score_rows(fake.pipe)] == ["job-1", "job-1"]
+    assert json.loads(fake.pipe.values["aegis:processed:job-1"])["pathway_pushed"] == 2
+
+
+def test_queue_processed_writes_result_and_wakes_waiters():
+    pipe = FakePipeline()
+    redis_client.queue_processed(pipe, "s1", {"severity": "low"}, ttl=120)
+    assert json.loads(pipe.values[redis_client.PROCESSED_KEY.format(session_id="s1")]) == {"severity": "low"}
+    notify_key = redis_client.NOTIFY_KEY.format(session_id="s1")
+    assert (notify_key, (1,)) in pipe.calls
+    assert pipe.ttls[notify_key] == 120
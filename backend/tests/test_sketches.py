@@ -0,0 +1,108 @@
+# tests/test_sketches.py
+import random
+
+import pytest
+
+from pathway_engine.sketches import HyperLogLog, KLLSketch
+
+
+def true_quantile(values, q):
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)]
+
+
+# ------------------------------
+# KLL
+# ------------------------------
+def test_kll_empty():
+    assert KLLSketch().quantile(0.5) == 0.0
+
+
+def test_kll_small_stream_is_exact():
+    sketch = KLLSketch(seed=1)
+    for v in [0.1, 0.2, 0.3, 0.4, 0.5]:
+        sketch.update(v)
+    assert sketch.quantile(0.0) == pytest.approx(0.1)
+    assert sketch.quantile(0.5) == pytest.approx(0.3)
+    assert sketch.quantile(1.0) == pytest.approx(0.5)
+
+
+@pytest.mark.parametrize("q", [0.5, 0.95, 0.99])
+def test_kll_rank_error(q):
+    rng = random.Random(7)
+    values = [rng.random() for _ in range(50_000)]
+    sketch = KLLSketch(seed=7)
+    for v in values:
+        sketch.update(v)
+    # uniform [0, 1): value error equals rank error; k=200 is ~1%
+    assert abs(sketch.quantile(q) - true_quantile(values, q)) < 0.03
+    assert sketch._size() < 50_000 // 10
+
+
+def test_kll_merge_matches_single_stream():
+    rng = random.Random(3)
+    a, b = KLLSketch(seed=1), KLLSketch(seed=2)
+    values = [rng.random() for _ in range(20_000)]
+    for v in values[:10_000]:
+        a.update(v)
+    for v in values[10_000:]:
+        b.update(v)
+    a.merge(b)
+    assert a.n == 20_000
+    assert abs(a.quantile(0.95) - true_quantile(values, 0.95)) < 0.03
+
+
+def test_kll_roundtrip():
+    sketch = KLLSketch(seed=5)
+    for i in range(5000):
+        sketch.update(i / 5000)
+    restored = KLLSketch.deserialize(sketch.serialize())
+    assert restored.n == sketch.n
+    assert restored.quantile(0.5) == pytest.approx(sketch.quantile(0.5), abs=1e-6)
+
+
+# ------------------------------
+# HyperLogLog
+# ------------------------------
+def test_hll_empty():
+    assert HyperLogLog().count() == 0
+
+
+def test_hll_duplicates_count_once():
+    hll = HyperLogLog()
+    for _ in range(1000):
+        hll.add("session-1")
+    assert hll.count() == 1
+
+
+@pytest.mark.parametrize("n", [100, 10_000, 100_000])
+def test_hll_relative_error(n):
+    hll = HyperLogLog()
+    for i in range(n):
+        hll.add(f"session-{i}")
+    # p=12 has ~1.6% standard error; allow about 3 sigma
+    assert abs(hll.count() - n) / n < 0.05
+
+
+def test_hll_merge_is_union():
+    a, b = HyperLogLog(), HyperLogLog()
+    for i in range(6000):
+        a.add(i)
+    for i in range(4000, 10_000):
+        b.add(i)
+    a.merge(b)
+    assert abs(a.count() - 10_000) / 10_000 < 0.05
+
+
+def test_hll_rejects_mismatched_precision():
+    with pytest.raises(ValueError):
+        HyperLogLog(p=12).merge(HyperLogLog(p=10))
+
+
+def test_hll_roundtrip():
+    hll = HyperLogLog()
+    for i in range(2500):
+        hll.add(i)
+    restored = HyperLogLog.deserialize(hll.serialize())
+    assert restored.p == hll.p
+    assert restored.count() == hll.count()